@@ -0,0 +1,122 @@
+"""
+module: config.py
+purpose: application settings, read once from the environment
+"""
+
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
+from dotenv import load_dotenv
+import os
+
+class Settings(BaseModel):
+    # every field is read from the environment variable with its name in upper case
+    model_config = ConfigDict(frozen=True)
+
+    # database
+    mongo_uri: Optional[str] = None
+    mongo_database: str = "auth_jwt_project"
+    mongo_max_pool_size: Optional[int] = None
+    mongo_min_pool_size: Optional[int] = None
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    mongo_server_selection_timeout_ms: Optional[int] = None
+    mongo_connect_timeout_ms: Optional[int] = None
+    mongo_socket_timeout_ms: Optional[int] = None
+    # where the users live: "mongo", or "memory" for load tests and local development,
+    # which keeps every other store in the process too (see uses_mongo)
+    user_repository: str = "mongo"
+
+    # authentication
+    secret_key: Optional[str] = None
+    algorithm: str = "HS256"
+    access_token_expire_time: int = 30
+    private_key_path: Optional[str] = None
+    private_key: Optional[str] = None
+    key_id: Optional[str] = None
+    retired_keys: str = ""
+    jwks_max_age: int = 3600
+    # machine clients, see app/utils/clients.py, and the key of their secret digests
+    service_clients: str = ""
+    client_secret_key: Optional[str] = None
+    # a cached client token is handed out until this many seconds before it expires
+    client_token_refresh_margin: float = 60
+    # embed the profile (username, created_at, version) in the tokens so /users/me
+    # is answered from the token alone
+    profile_claims: bool = False
+
+    # password hashing, bcrypt cost factor (log2 rounds)
+    bcrypt_rounds: int = 12
+
+    # password hashing pool
+    password_hash_workers: int = os.cpu_count() or 4
+    password_hash_queue_size: int = 64
+    password_hash_retry_after: int = 1
+
+    # most ids or emails resolved by one POST /users/lookup
+    user_lookup_max: int = 100
+
+    # largest page of GET /users, and documents read per batch by GET /users/export
+    user_page_max: int = 1000
+    user_export_batch_size: int = 1000
+
+    # caches
+    token_cache_size: int = 10000
+    token_cache_ttl: float = 300
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 60
+
+    # Idempotency-Key on registration: responses kept for idempotency_ttl seconds,
+    # in each worker and also in mongo when idempotency_mongo is on
+    idempotency_ttl: float = 86400
+    idempotency_cache_size: int = 10000
+    idempotency_mongo: bool = False
+
+    # login throttling, token buckets per email and per client ip (a burst of 0
+    # disables a limit, the refill rates must be positive), kept in each worker
+    # ("memory") or shared by all of them ("mongo")
+    login_email_burst: float = Field(default=5, ge=0)
+    login_email_per_minute: float = Field(default=5, gt=0)
+    login_ip_burst: float = Field(default=20, ge=0)
+    login_ip_per_minute: float = Field(default=60, gt=0)
+    login_throttle_backend: str = "memory"
+    login_throttle_max_buckets: int = 100000
+
+    # login audit, events written every login_audit_batch_size events or
+    # login_audit_flush_ms milliseconds, dropped once login_audit_queue_size are waiting
+    login_audit_batch_size: int = 500
+    login_audit_flush_ms: float = 200
+    login_audit_queue_size: int = 10000
+
+    # token revocation
+    revocation_refresh_interval: float = 5
+
+    @property
+    def uses_mongo(self) -> bool:
+        # with the users in memory, the revoked tokens, login events and other
+        # stores stay in the process too and mongo is never reached
+        return self.user_repository != "memory"
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        values = {}
+        for name in cls.model_fields:
+            value = os.getenv(name.upper())
+            if value is not None and value != "":
+                values[name] = value
+
+        return cls(**values)
+
+_settings = None
+
+def get_settings() -> Settings:
+    # .env is loaded here and only here, the first time settings are needed
+    global _settings
+    if _settings is None:
+        load_dotenv()
+        _settings = Settings.from_env()
+
+    return _settings
+
+def set_settings(settings: Settings):
+    global _settings
+    _settings = settings
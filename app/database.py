@@ -3,18 +3,98 @@ module: database.py
 purpose: store database configuration and connections
 """
 
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from pymongo import AsyncMongoClient
+from app.config import Settings, get_settings
+from app.utils.metrics import MongoCommandMetrics, MongoPoolMetrics
 import os
 
-load_dotenv()
+# pool and timeout options, passed to the client only when they are configured
+POOL_OPTIONS = {
+        "maxPoolSize": "mongo_max_pool_size",
+        "minPoolSize": "mongo_min_pool_size",
+        "maxIdleTimeMS": "mongo_max_idle_time_ms",
+        "waitQueueTimeoutMS": "mongo_wait_queue_timeout_ms",
+        "serverSelectionTimeoutMS": "mongo_server_selection_timeout_ms",
+        "connectTimeoutMS": "mongo_connect_timeout_ms",
+        "socketTimeoutMS": "mongo_socket_timeout_ms"
+        }
 
-mongo_uri = os.getenv("MONGO_URI")
+pool_metrics = MongoPoolMetrics()
 
-client = MongoClient(mongo_uri)
-db = client["auth_jwt_project"]
+client = None
+db = None
+# pid of the process that created the client, a forked worker must not reuse it
+client_pid = None
+
+# fields needed to build a UserResponse, the profile claims and the admin check,
+# _id is always returned by mongo
+USER_RESPONSE_PROJECTION = {"username": 1, "email": 1, "created_at": 1, "profile_version": 1, "role": 1}
+
+# the UserResponse fields only, for the admin listing and export
+USER_LIST_PROJECTION = {"username": 1, "email": 1, "created_at": 1}
+
+def pool_options(settings: Settings) -> dict:
+    options = {}
+    for option, field in POOL_OPTIONS.items():
+        value = getattr(settings, field)
+        if value is not None:
+            options[option] = value
+
+    return options
+
+def connect_database():
+    # the client is created by the lifespan handler of each worker, after the
+    # fork, or on first use outside of it
+    global client, db, client_pid
+    if db is None or (client is not None and client_pid != os.getpid()):
+        settings = get_settings()
+        client = AsyncMongoClient(
+                settings.mongo_uri,
+                event_listeners=[MongoCommandMetrics(), pool_metrics],
+                **pool_options(settings)
+                )
+        client_pid = os.getpid()
+        db = client[settings.mongo_database]
+
+    return db
+
+async def close_database():
+    global client, db, client_pid
+    if client is not None and client_pid == os.getpid():
+        await client.close()
+    client = None
+    db = None
+    client_pid = None
+
+async def ping_database():
+    await connect_database().command("ping")
 
 def get_collection(collection_name: str):
-    collection = db[collection_name]
+    collection = connect_database()[collection_name]
 
     return collection
+
+async def ensure_indexes():
+    # unique email index: backs the email lookups and rejects duplicate registrations
+    users = get_collection("users")
+    await users.create_index("email", unique=True)
+
+    # revoked tokens are dropped by mongo once the token would have expired anyway
+    revoked_tokens = get_collection("revoked_tokens")
+    await revoked_tokens.create_index("jti", unique=True)
+    await revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await revoked_tokens.create_index("revoked_at")
+
+    # login history of a user, latest first
+    login_events = get_collection("login_events")
+    await login_events.create_index([("user_id", 1), ("at", -1)])
+
+    # stored registration responses are dropped once their Idempotency-Key expires
+    if get_settings().idempotency_mongo:
+        idempotency_keys = get_collection("idempotency_keys")
+        await idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+
+    # shared login throttle buckets are dropped once they would be full again
+    if get_settings().login_throttle_backend == "mongo":
+        login_buckets = get_collection("login_buckets")
+        await login_buckets.create_index("expires_at", expireAfterSeconds=0)
@@ -1,17 +1,128 @@
 """
 module: main.py
-purpose: contain the main application
+purpose: contain the application factory and the default application
 """
 
+import time
+
+# measured before the application modules are imported, to report the import cost
+IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 from fastapi import FastAPI
-from app.routes import auth, users
+from app.config import Settings, get_settings, set_settings
+from app.routes import auth, users, wellknown, operations
+from app.database import connect_database, close_database
+from app.repository import set_user_repository, user_repository
+from app.utils.password_pool import password_pool
+from app.utils.security import get_key_ring, reset_keys
+from app.utils.dependencies import user_cache
+from app.utils.revocation import revocation_list
+from app.utils.rate_limit import login_throttle, bucket_store
+from app.utils.idempotency import idempotency_store
+from app.utils.login_audit import login_audit
+from app.utils.metrics import MetricsMiddleware
+from app.utils.responses import FastJSONResponse
+from app.utils.warmup import warm_up
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+logger = logging.getLogger(__name__)
+
+# seconds given to the login audit to write its queue on shutdown
+AUDIT_DRAIN_TIMEOUT = 5
+
+def configure(settings: Settings):
+    set_settings(settings)
+    reset_keys()
+    set_user_repository(user_repository(settings.user_repository))
+
+    password_pool.configure(
+            workers=settings.password_hash_workers,
+            queue_size=settings.password_hash_queue_size,
+            retry_after=settings.password_hash_retry_after
+            )
+    user_cache.maxsize = settings.user_cache_size
+    user_cache.ttl = settings.user_cache_ttl
+    revocation_list.refresh_interval = settings.revocation_refresh_interval
+    revocation_list.memory = not settings.uses_mongo
+    login_audit.configure(
+            batch_size=settings.login_audit_batch_size,
+            flush_interval=settings.login_audit_flush_ms / 1000,
+            queue_size=settings.login_audit_queue_size,
+            memory=not settings.uses_mongo
+            )
+    idempotency_store.configure(
+            maxsize=settings.idempotency_cache_size,
+            ttl=settings.idempotency_ttl,
+            mongo=settings.idempotency_mongo and settings.uses_mongo
+            )
+    throttle_backend = settings.login_throttle_backend if settings.uses_mongo else "memory"
+    login_throttle.configure(
+            store=bucket_store(throttle_backend, settings.login_throttle_max_buckets),
+            email_capacity=settings.login_email_burst,
+            email_per_minute=settings.login_email_per_minute,
+            ip_capacity=settings.login_ip_burst,
+            ip_per_minute=settings.login_ip_per_minute
+            )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # runs in every worker after the fork: network resources and threads are
+    # created here (or lazily), never at import time
+    started = time.perf_counter()
+
+    # fail fast on a missing or unreadable key instead of on the first login
+    get_key_ring()
+    if get_settings().uses_mongo:
+        connect_database()
+
+    # the worker accepts connections right away but reports not ready until the
+    # warm-up is done, so load balancers only send traffic to warm workers
+    app.state.ready = False
+    warmup_task = asyncio.create_task(warm_up(app))
+    revocation_task = asyncio.create_task(revocation_list.run())
+    audit_task = asyncio.create_task(login_audit.run())
+
+    app.state.startup["lifespan_seconds"] = round(time.perf_counter() - started, 4)
+    logger.info("worker started: %s", app.state.startup)
+
+    yield
+    warmup_task.cancel()
+    revocation_task.cancel()
+
+    # the queued login events are written before the client is closed
+    login_audit.stop()
+    await asyncio.wait([audit_task], timeout=AUDIT_DRAIN_TIMEOUT)
+    audit_task.cancel()
+
+    password_pool.shutdown()
+    await close_database()
+
+def create_app(settings: None|Settings = None) -> FastAPI:
+    started = time.perf_counter()
+    configure(settings or get_settings())
+
+    # the endpoints returning plain dicts are rendered by the same compiled serializer
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+    app.add_middleware(MetricsMiddleware)
+
+    # routers
+    app.include_router(operations.router)
+    app.include_router(auth.router)
+    app.include_router(users.router)
+    app.include_router(wellknown.router)
 
-app = FastAPI()
+    app.state.startup = {
+            "import_seconds": round(IMPORT_SECONDS, 4),
+            "factory_seconds": round(time.perf_counter() - started, 4),
+            "lifespan_seconds": None,
+            "warmup": {}
+            }
+    app.state.ready = False
 
-# routers
-app.include_router(auth.router)
-app.include_router(users.router)
+    return app
 
-@app.get('/')
-def root():
-    return {"status":"OK"}
+app = create_app()
@@ -6,6 +6,7 @@ purpose: pydantic validation schemas
 from pydantic import BaseModel, field_validator, EmailStr, SecretStr, model_validator
 from typing import Optional
 from datetime import datetime
+from app.config import get_settings
 
 class UserCreate(BaseModel):
     username: str
@@ -25,6 +26,38 @@ class UserResponse(BaseModel):
     email: EmailStr
     created_at: datetime
 
+class UserLookup(BaseModel):
+    # ids or emails, resolved in the order they are given
+    ids: Optional[list[str]] = None
+    emails: Optional[list[EmailStr]] = None
+
+    # checked on the raw lists, an oversized body is rejected before its keys are validated
+    @field_validator("ids", "emails", mode="before")
+    def validate_size(cls, v):
+        lookup_max = get_settings().user_lookup_max
+        if isinstance(v, list) and len(v) > lookup_max:
+            raise ValueError(f"At most {lookup_max} users per lookup")
+        return v
+
+    @model_validator(mode="after")
+    def validate_keys(self):
+        if (self.ids is None) == (self.emails is None):
+            raise ValueError("either ids or emails should be passed")
+        return self
+
+class UserLookupResult(BaseModel):
+    key: str
+    # None when no user matches the key
+    user: Optional[UserResponse]
+
+class UserLookupResponse(BaseModel):
+    results: list[UserLookupResult]
+
+class UserPage(BaseModel):
+    users: list[UserResponse]
+    # the after of the next page, None on the last one
+    next: Optional[str]
+
 class UserDB(BaseModel):
     _id: str
     username: str
@@ -32,6 +65,10 @@ class UserDB(BaseModel):
     hashed_password: str
     created_at: datetime
     role: str = "user"
+    # bumped by every profile update, tokens with an older one carry stale claims
+    profile_version: int = 0
+    # written in batches by the login audit
+    last_login_at: Optional[datetime] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -0,0 +1,283 @@
+"""
+module: repository.py
+purpose: user storage behind one interface, in mongo or in memory
+"""
+
+from app.database import get_collection, USER_LIST_PROJECTION, USER_RESPONSE_PROJECTION
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from abc import ABC, abstractmethod
+import heapq
+import threading
+
+class DuplicateUserError(Exception):
+    """the email already belongs to another user"""
+
+def to_object_id(user_id):
+    # ids arrive as strings from the tokens, anything that is not an ObjectId is
+    # kept as is and simply matches no document
+    if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+        return ObjectId(user_id)
+
+    return user_id
+
+class UserRepository(ABC):
+    """
+    every read and write of the users goes through here. the profile reads
+    return the USER_RESPONSE_PROJECTION fields, find_by_email returns the whole
+    document since login needs the hash
+    """
+
+    @abstractmethod
+    async def create(self, user: dict):
+        ...
+
+    @abstractmethod
+    async def find_by_id(self, user_id) -> None|dict:
+        ...
+
+    @abstractmethod
+    async def find_by_email(self, email: str) -> None|dict:
+        ...
+
+    @abstractmethod
+    async def find_many_by_ids(self, user_ids: list) -> list:
+        ...
+
+    @abstractmethod
+    async def find_many_by_emails(self, emails: list) -> list:
+        ...
+
+    @abstractmethod
+    async def update_profile(self, user_id, fields: dict) -> None|dict:
+        # sets the fields and bumps profile_version, None when the user is gone
+        ...
+
+    @abstractmethod
+    async def replace_password_hash(self, user_id, old_hash: str, new_hash: str) -> bool:
+        # only replaces old_hash, so a concurrent password change wins
+        ...
+
+    @abstractmethod
+    async def delete(self, user_id) -> bool:
+        ...
+
+    @abstractmethod
+    async def record_last_logins(self, last_logins: dict):
+        # user id -> time of its latest login, an older time never overwrites a newer one
+        ...
+
+    @abstractmethod
+    async def list_users(self, after: None|ObjectId, limit: int) -> list:
+        # keyset page: the next limit users with an _id above after, in _id order,
+        # with the USER_LIST_PROJECTION fields
+        ...
+
+    async def iter_users(self, batch_size: int):
+        # every user in _id order, one keyset page of batch_size at a time
+        after = None
+        while True:
+            users = await self.list_users(after, batch_size)
+            for user in users:
+                yield user
+            if len(users) < batch_size:
+                return
+            after = users[-1]["_id"]
+
+class MongoUserRepository(UserRepository):
+
+    collection_name = "users"
+
+    @property
+    def collection(self):
+        return get_collection(self.collection_name)
+
+    async def create(self, user: dict):
+        # the unique email index turns a duplicate registration into a DuplicateKeyError
+        try:
+            await self.collection.insert_one(user)
+        except DuplicateKeyError:
+            raise DuplicateUserError(user["email"])
+
+    async def find_by_id(self, user_id) -> None|dict:
+        return await self.collection.find_one({"_id": to_object_id(user_id)}, USER_RESPONSE_PROJECTION)
+
+    async def find_by_email(self, email: str) -> None|dict:
+        return await self.collection.find_one({"email": email})
+
+    async def find_many_by_ids(self, user_ids: list) -> list:
+        object_ids = list({to_object_id(user_id) for user_id in user_ids if ObjectId.is_valid(user_id)})
+        cursor = self.collection.find({"_id": {"$in": object_ids}}, USER_RESPONSE_PROJECTION)
+        return await cursor.to_list(None)
+
+    async def find_many_by_emails(self, emails: list) -> list:
+        cursor = self.collection.find({"email": {"$in": list(set(emails))}}, USER_RESPONSE_PROJECTION)
+        return await cursor.to_list(None)
+
+    async def update_profile(self, user_id, fields: dict) -> None|dict:
+        # one round trip: the unique email index reports conflicts as DuplicateKeyError
+        try:
+            return await self.collection.find_one_and_update(
+                    {"_id": user_id},
+                    {"$set": fields, "$inc": {"profile_version": 1}},
+                    projection=USER_RESPONSE_PROJECTION,
+                    return_document=ReturnDocument.AFTER
+                    )
+        except DuplicateKeyError:
+            raise DuplicateUserError(fields.get("email"))
+
+    async def replace_password_hash(self, user_id, old_hash: str, new_hash: str) -> bool:
+        result = await self.collection.update_one(
+                {"_id": user_id, "hashed_password": old_hash},
+                {"$set": {"hashed_password": new_hash}}
+                )
+        return result.modified_count == 1
+
+    async def delete(self, user_id) -> bool:
+        result = await self.collection.delete_one({"_id": user_id})
+        return result.deleted_count == 1
+
+    async def record_last_logins(self, last_logins: dict):
+        await self.collection.bulk_write(
+                [
+                    UpdateOne({"_id": user_id}, {"$max": {"last_login_at": logged_in_at}})
+                    for user_id, logged_in_at in last_logins.items()
+                    ],
+                ordered=False
+                )
+
+    async def list_users(self, after: None|ObjectId, limit: int) -> list:
+        # walks the _id index from after, however deep the page is
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        cursor = self.collection.find(query, USER_LIST_PROJECTION).sort("_id", 1).limit(limit)
+        return await cursor.to_list(None)
+
+    async def iter_users(self, batch_size: int):
+        # one cursor for the whole collection, only its current batch is in memory
+        cursor = self.collection.find({}, USER_LIST_PROJECTION).sort("_id", 1).batch_size(batch_size)
+        try:
+            async for user in cursor:
+                yield user
+        finally:
+            await cursor.close()
+
+class MemoryUserRepository(UserRepository):
+    """
+    users of this process only, for load tests and local development. documents
+    are indexed by str(_id) and by email, one lock keeps both indexes consistent
+    with the worker threads, and copies are returned so callers can't modify them
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_email = {}
+
+    @staticmethod
+    def _project(user: dict, projection: dict = USER_RESPONSE_PROJECTION) -> dict:
+        return {
+                field: user[field]
+                for field in ("_id", *projection)
+                if field in user
+                }
+
+    async def create(self, user: dict):
+        with self._lock:
+            if user["email"] in self._by_email:
+                raise DuplicateUserError(user["email"])
+            self._by_id[str(user["_id"])] = dict(user)
+            self._by_email[user["email"]] = str(user["_id"])
+
+    async def find_by_id(self, user_id) -> None|dict:
+        with self._lock:
+            user = self._by_id.get(str(user_id))
+            return self._project(user) if user is not None else None
+
+    async def find_by_email(self, email: str) -> None|dict:
+        with self._lock:
+            user_id = self._by_email.get(email)
+            user = self._by_id.get(user_id) if user_id is not None else None
+            return dict(user) if user is not None else None
+
+    async def find_many_by_ids(self, user_ids: list) -> list:
+        with self._lock:
+            users = [self._by_id.get(str(user_id)) for user_id in set(user_ids)]
+            return [self._project(user) for user in users if user is not None]
+
+    async def find_many_by_emails(self, emails: list) -> list:
+        with self._lock:
+            users = [self._by_id[self._by_email[email]] for email in set(emails) if email in self._by_email]
+            return [self._project(user) for user in users]
+
+    async def update_profile(self, user_id, fields: dict) -> None|dict:
+        with self._lock:
+            user = self._by_id.get(str(user_id))
+            if user is None:
+                return None
+
+            email = fields.get("email", user["email"])
+            if self._by_email.get(email, str(user_id)) != str(user_id):
+                raise DuplicateUserError(email)
+
+            del self._by_email[user["email"]]
+            user.update(fields)
+            user["profile_version"] = user.get("profile_version", 0) + 1
+            self._by_email[user["email"]] = str(user_id)
+
+            return self._project(user)
+
+    async def replace_password_hash(self, user_id, old_hash: str, new_hash: str) -> bool:
+        with self._lock:
+            user = self._by_id.get(str(user_id))
+            if user is None or user["hashed_password"] != old_hash:
+                return False
+
+            user["hashed_password"] = new_hash
+            return True
+
+    async def delete(self, user_id) -> bool:
+        with self._lock:
+            user = self._by_id.pop(str(user_id), None)
+            if user is None:
+                return False
+
+            del self._by_email[user["email"]]
+            return True
+
+    async def record_last_logins(self, last_logins: dict):
+        with self._lock:
+            for user_id, logged_in_at in last_logins.items():
+                user = self._by_id.get(str(user_id))
+                if user is not None and (user.get("last_login_at") is None or user["last_login_at"] < logged_in_at):
+                    user["last_login_at"] = logged_in_at
+
+    async def list_users(self, after: None|ObjectId, limit: int) -> list:
+        # str(ObjectId) is fixed length hex, so the keys sort like the ids
+        with self._lock:
+            user_ids = heapq.nsmallest(limit, (
+                user_id for user_id in self._by_id
+                if after is None or user_id > str(after)
+                ))
+            return [self._project(self._by_id[user_id], USER_LIST_PROJECTION) for user_id in user_ids]
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+def user_repository(backend: str) -> UserRepository:
+    if backend == "mongo":
+        return MongoUserRepository()
+    if backend == "memory":
+        return MemoryUserRepository()
+
+    raise ValueError(f"Unknown user repository backend: {backend}")
+
+_repository = MongoUserRepository()
+
+def get_user_repository() -> UserRepository:
+    return _repository
+
+def set_user_repository(repository: UserRepository):
+    # configured from the settings by create_app
+    global _repository
+    _repository = repository
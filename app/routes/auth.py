@@ -3,74 +3,173 @@ module: auth.py
 purpose: authentication endpoints
 """
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Request, status
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from app.models import UserCreate, UserDB, UserLogin, UserResponse
-from app.database import get_collection
-from app.utils.security import create_access_token, hash_password, verify_password
+from app.repository import DuplicateUserError, get_user_repository
+from app.utils.security import create_access_token, hash_password, verify_password, needs_rehash, user_claims
+from app.utils.password_pool import password_pool
+from app.utils.dependencies import get_token_payload
+from app.utils.revocation import revocation_list
+from app.utils.rate_limit import login_throttle
+from app.utils.responses import FastJSONResponse, user_etag, user_response
+from app.utils.idempotency import idempotency_store, fingerprint
+from app.utils.clients import issue_client_token
+from app.utils.login_audit import login_audit
 from datetime import datetime, timezone
 from bson import ObjectId
+from urllib.parse import parse_qs
+import json
+import logging
 
 router = APIRouter(prefix="/auth")
 
+logger = logging.getLogger(__name__)
+
+client_basic = HTTPBasic(auto_error=False)
+
+async def rehash_password(user_id, password: str, old_hashed_password: str):
+    # runs after the login response is sent. only the old hash is replaced, so a
+    # concurrent password change is not overwritten
+    try:
+        new_hashed_password = await password_pool.run(hash_password, password)
+        await get_user_repository().replace_password_hash(user_id, old_hashed_password, new_hashed_password)
+    except HTTPException:
+        # hashing pool is full, the next login will try again
+        pass
+    except Exception:
+        logger.exception("could not rehash the password of user %s", user_id)
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user_data: UserCreate):
-    collection = get_collection("users")
+async def register_user(user_data: UserCreate, idempotency_key: None|str = Header(default=None)):
+    if idempotency_key is None:
+        return await create_user(user_data)
+
+    # retries of a timed out registration get the first response back, without
+    # hashing or writing again. the password is left out of the fingerprint, it
+    # would be kept next to the key
+    request_fingerprint = fingerprint(user_data.email.lower().strip(), user_data.username)
+    return await idempotency_store.run(idempotency_key, request_fingerprint, lambda: create_user(user_data))
+
+async def create_user(user_data: UserCreate):
     normalized_email = user_data.email.lower().strip()
 
-    existing_user = collection.find_one({"email":normalized_email})
-    if existing_user:
+    hashed_password = await password_pool.run(hash_password, user_data.password.get_secret_value())
+    unique_id = ObjectId()
+
+    new_user = UserDB(
+            _id=str(unique_id),
+            email=normalized_email,
+            username=user_data.username,
+            hashed_password=hashed_password,
+            created_at=datetime.now(timezone.utc)
+            )
+
+    # _id is a private attribute of UserDB so model_dump leaves it out
+    document = new_user.model_dump()
+    document["_id"] = unique_id
+
+    try:
+        await get_user_repository().create(document)
+    except DuplicateUserError:
         raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="User already exist"
                 )
-    else:
-        hashed_password = hash_password(user_data.password.get_secret_value())
-        unique_id = ObjectId()
-
-        new_user = UserDB(
-                _id=str(unique_id),
-                email=normalized_email,
-                username=user_data.username,
-                hashed_password=hashed_password,
-                created_at=datetime.now(timezone.utc)
-                )
- 
-        collection.insert_one(new_user.model_dump())
-
-        return UserResponse(
-                id=str(unique_id),
-                username=user_data.username,
-                email=user_data.email,
-                created_at=datetime.now(timezone.utc)
-                )
+
+    return user_response(document, status_code=status.HTTP_201_CREATED, headers={"ETag": user_etag(document)})
 
 @router.post("/login", status_code=status.HTTP_200_OK)
-def login_user(user_data: UserLogin):
-    collection = get_collection("users")
+async def login_user(user_data: UserLogin, request: Request, background_tasks: BackgroundTasks):
     normalized_email = user_data.email.lower().strip()
 
-    existing_user = collection.find_one({"email":normalized_email})
+    # rejects floods before they cost a lookup or a bcrypt check
+    client_ip = request.client.host if request.client else None
+    await login_throttle.check(normalized_email, client_ip)
+
+    existing_user = await get_user_repository().find_by_email(normalized_email)
     if not existing_user:
+        login_audit.record(None, normalized_email, False, client_ip)
         raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect Credentials"
                 )
     else:
-        verify = verify_password(user_data.password.get_secret_value(), existing_user["hashed_password"])
+        verify = await password_pool.run(verify_password, user_data.password.get_secret_value(), existing_user["hashed_password"])
+        login_audit.record(existing_user["_id"], normalized_email, verify, client_ip)
         if verify:
-            access_token = create_access_token(
-                    {
-                        "sub":str(existing_user["_id"]),
-                        "email": existing_user["email"]
-                        }
-                    )
+            if needs_rehash(existing_user["hashed_password"]):
+                background_tasks.add_task(
+                        rehash_password,
+                        existing_user["_id"],
+                        user_data.password.get_secret_value(),
+                        existing_user["hashed_password"]
+                        )
+
+            access_token = create_access_token(user_claims(existing_user))
 
-            return {
+            return FastJSONResponse({
                     "access_token": access_token,
                     "token_type": "bearer"
-                    }
+                    })
         else:
             raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Incorrect Credentials"
                     )
+
+@router.post("/token", status_code=status.HTTP_200_OK)
+async def client_credentials_token(request: Request, credentials: None|HTTPBasicCredentials = Depends(client_basic)):
+    # OAuth2 client credentials grant for other services. the form body is
+    # parsed here (no multipart dependency), JSON is accepted as well
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            fields = json.loads(body or b"{}")
+        else:
+            fields = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="invalid_request"
+                )
+
+    if not isinstance(fields, dict) or not isinstance(fields.get("scope", ""), str):
+        raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="invalid_request"
+                )
+    if fields.get("grant_type") != "client_credentials":
+        raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="unsupported_grant_type"
+                )
+
+    # HTTP Basic is preferred, the client may also send its credentials in the body
+    if credentials is not None:
+        client_id, client_secret = credentials.username, credentials.password
+    else:
+        client_id, client_secret = fields.get("client_id"), fields.get("client_secret")
+    if not isinstance(client_id, str) or not isinstance(client_secret, str):
+        raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="invalid_client",
+                headers={"WWW-Authenticate": "Basic"}
+                )
+
+    return FastJSONResponse(
+            issue_client_token(client_id, client_secret, fields.get("scope")),
+            headers={"Cache-Control": "no-store"}
+            )
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_user(payload: dict = Depends(get_token_payload)):
+    jti = payload.get("jti")
+    exp = payload.get("exp")
+    if not jti or not exp:
+        raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Token can't be revoked"
+                )
+
+    await revocation_list.revoke(jti, datetime.fromtimestamp(exp, timezone.utc))
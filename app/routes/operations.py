@@ -0,0 +1,98 @@
+"""
+module: operations.py
+purpose: readiness, statistics and metrics endpoints
+"""
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.config import get_settings
+from app.database import ping_database, pool_metrics
+from app.utils.password_pool import password_pool
+from app.utils.security import get_token_verifier
+from app.utils.dependencies import user_cache
+from app.utils.revocation import revocation_list
+from app.utils.rate_limit import login_throttle
+from app.utils.idempotency import idempotency_store
+from app.utils.login_audit import login_audit
+from app.utils.metrics import Gauge, registry
+
+router = APIRouter()
+
+@router.get('/')
+async def root(request: Request):
+    # readiness probe: the worker is ready once warmed up, while the pool can reach
+    # mongo when it is used
+    if not request.app.state.ready:
+        return JSONResponse(
+                status_code=503,
+                content={"status":"WARMING_UP"}
+                )
+
+    if not get_settings().uses_mongo:
+        return {"status":"OK"}
+
+    try:
+        await ping_database()
+    except Exception:
+        return JSONResponse(
+                status_code=503,
+                content={"status":"UNAVAILABLE", "database":"unreachable"}
+                )
+
+    return {"status":"OK"}
+
+@router.get('/stats')
+def stats(request: Request):
+    return {
+            "startup": request.app.state.startup,
+            "password_pool": password_pool.stats(),
+            "token_cache": get_token_verifier().cache.stats(),
+            "user_cache": user_cache.stats(),
+            "revoked_tokens": len(revocation_list),
+            "login_throttle": login_throttle.stats(),
+            "idempotency": idempotency_store.stats(),
+            "login_audit": login_audit.stats(),
+            "mongo_pool": pool_metrics.stats()
+            }
+
+def cache_stats(field: str) -> dict:
+    return {
+            ("token",): get_token_verifier().cache.stats()[field],
+            ("user",): user_cache.stats()[field]
+            }
+
+def password_pool_stats(field: str) -> dict:
+    return {(): password_pool.stats()[field]}
+
+# the stats of the pools and caches are read when /metrics is scraped
+registry.register(Gauge("password_pool_queue_depth", "Password hashing jobs waiting for a worker",
+                        function=lambda: password_pool_stats("queue_depth")))
+registry.register(Gauge("password_pool_in_flight", "Password hashing jobs queued or running",
+                        function=lambda: password_pool_stats("in_flight")))
+registry.register(Gauge("password_pool_rejected_total", "Password hashing jobs rejected because the queue was full",
+                        function=lambda: password_pool_stats("rejected"), kind="counter"))
+registry.register(Gauge("cache_entries", "Entries in the in-process caches", ("cache",),
+                        function=lambda: cache_stats("size")))
+registry.register(Gauge("cache_hits_total", "Lookups served by the in-process caches", ("cache",),
+                        function=lambda: cache_stats("hits"), kind="counter"))
+registry.register(Gauge("cache_misses_total", "Lookups missed by the in-process caches", ("cache",),
+                        function=lambda: cache_stats("misses"), kind="counter"))
+registry.register(Gauge("cache_evictions_total", "Entries evicted from the in-process caches", ("cache",),
+                        function=lambda: cache_stats("evictions"), kind="counter"))
+registry.register(Gauge("mongo_pool_checked_out", "Connections checked out of the mongo pool",
+                        function=lambda: {(): pool_metrics.stats()["checked_out"]}))
+registry.register(Gauge("login_throttle_rejected_total", "Login attempts rejected by the throttle", ("key",),
+                        function=lambda: {
+                            ("email",): login_throttle.stats()["rejected_email"],
+                            ("ip",): login_throttle.stats()["rejected_ip"]
+                            }, kind="counter"))
+registry.register(Gauge("login_audit_queue_depth", "Login events waiting to be written",
+                        function=lambda: {(): login_audit.stats()["queued"]}))
+registry.register(Gauge("login_audit_dropped_total", "Login events dropped because the queue was full",
+                        function=lambda: {(): login_audit.stats()["dropped"]}, kind="counter"))
+registry.register(Gauge("revoked_tokens", "Revoked, not yet expired tokens known by this worker",
+                        function=lambda: {(): len(revocation_list)}))
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
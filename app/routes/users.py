@@ -3,93 +3,185 @@ module: users.py
 purpose: user management endpoints (need authentication)
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from app.utils.dependencies import get_current_user
-from app.models import UserResponse, UserUpdate
-from app.database import get_collection
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from app.config import get_settings
+from app.utils.dependencies import (
+    get_current_user,
+    get_current_profile,
+    get_current_admin,
+    require_scope,
+    user_cache,
+)
+from app.utils.revocation import revocation_list
+from app.utils.security import create_access_token, user_claims
+from app.utils.responses import (
+    FastJSONResponse,
+    etag_matches,
+    ndjson_users,
+    user_etag,
+    user_model,
+    user_response,
+)
+from app.models import UserLookup, UserLookupResponse, UserPage, UserResponse, UserUpdate
+from app.repository import DuplicateUserError, get_user_repository
 
 router = APIRouter(prefix="/users")
 
+# clients may keep the profile but must revalidate it with If-None-Match
+PROFILE_CACHE_CONTROL = "private, no-cache"
 
-@router.get("/me", response_model=UserResponse)
-def get_my_profile(current_user: dict = Depends(get_current_user)) -> UserResponse:
-    response = UserResponse(
-        id=str(current_user["_id"]),
-        email=current_user["email"],
-        username=current_user["username"],
-        created_at=current_user["created_at"],
+# scope a client token needs for POST /users/lookup
+LOOKUP_SCOPE = "users:lookup"
+
+
+async def outdate_profile_claims(user_id: str, version: None | int = None) -> None:
+    # every worker stops answering from the claims of the user's older tokens (all
+    # of them without a version) until the last of those tokens has expired
+    settings = get_settings()
+    if not settings.profile_claims:
+        return
+
+    expires_at = datetime.now(timezone.utc) + timedelta(
+        minutes=settings.access_token_expire_time
     )
+    await revocation_list.outdate_profile(user_id, version, expires_at)
+
+
+@router.get("/me", response_model=UserResponse)
+async def get_my_profile(
+    request: Request,
+    current_user: dict = Depends(get_current_profile),
+) -> FastJSONResponse:
+    # the tag comes from the cached document or the token, an unchanged profile
+    # costs neither a database read nor a serialization
+    headers = {"ETag": user_etag(current_user), "Cache-Control": PROFILE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    return response
+    return user_response(current_user, headers=headers)
 
 
 @router.put("/me", response_model=UserResponse)
-def update_my_profile(
-    update_data: UserUpdate, current_user: dict = Depends(get_current_user)
-) -> UserResponse:
-    collection = get_collection("users")
-    if update_data.username and update_data.email is None:
-        collection.update_one(
-            {"_id": current_user["_id"]}, {"$set": {"username": update_data.username}}
+async def update_my_profile(
+    update_data: UserUpdate,
+    current_user: dict = Depends(get_current_user),
+) -> FastJSONResponse:
+    update_dict = {}
+    if update_data.username:
+        update_dict["username"] = update_data.username
+    if update_data.email:
+        update_dict["email"] = update_data.email.lower().strip()
+
+    try:
+        updated_user = await get_user_repository().update_profile(
+            current_user["_id"], update_dict
+        )
+    except DuplicateUserError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Incorrect Credentials"
         )
 
-        updated_user = collection.find_one({"_id": current_user["_id"]})
-        return UserResponse(
-            id=str(updated_user["_id"]),  # type: ignore
-            username=updated_user["username"],  # type: ignore
-            email=updated_user["email"],  # type: ignore
-            created_at=updated_user["created_at"],  # type: ignore
+    if updated_user is None:
+        user_cache.pop(str(current_user["_id"]))
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User Not Found"
         )
 
-    elif update_data.email and update_data.username is None:
-        normalized_email = update_data.email.lower().strip()
-
-        user_exists = collection.find_one({"email": normalized_email})
-        if not user_exists:
-            collection.update_one(
-                {"_id": current_user["_id"]}, {"$set": {"email": normalized_email}}
-            )
-
-            updated_user = collection.find_one({"_id": current_user["_id"]})
-            return UserResponse(
-                id=str(updated_user["_id"]),  # type: ignore
-                username=updated_user["username"],  # type: ignore
-                email=updated_user["email"],  # type: ignore
-                created_at=updated_user["created_at"],  # type: ignore
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT, detail="Incorrect Credentials"
-            )
+    user_cache.set(str(current_user["_id"]), updated_user)
 
+    # tokens issued before this update carry the old profile: no worker trusts
+    # them any more and the client gets a fresh one
+    await outdate_profile_claims(
+        str(current_user["_id"]), updated_user["profile_version"] - 1
+    )
+    headers = {"ETag": user_etag(updated_user), "Cache-Control": PROFILE_CACHE_CONTROL}
+    if get_settings().profile_claims:
+        headers["X-Access-Token"] = create_access_token(user_claims(updated_user))
+
+    return user_response(updated_user, headers=headers)
+
+
+@router.post("/lookup", response_model=UserLookupResponse)
+async def lookup_users(
+    lookup: UserLookup, service: dict = Depends(require_scope(LOOKUP_SCOPE))
+) -> FastJSONResponse:
+    # for other services: N ids or emails resolved by a single indexed $in query
+    keys = lookup.ids if lookup.ids is not None else lookup.emails
+
+    repository = get_user_repository()
+    if lookup.ids is not None:
+        # ids that are not ours are simply missing from the results
+        users = await repository.find_many_by_ids(keys)
+        found = {str(user["_id"]): user for user in users}
+        normalized = {key: key for key in keys}
     else:
-        normalized_email = update_data.email.lower().strip()  # type: ignore
+        normalized = {key: key.lower().strip() for key in keys}
+        users = await repository.find_many_by_emails(list(normalized.values()))
+        found = {user["email"]: user for user in users}
+
+    results = []
+    for key in keys:
+        user = found.get(normalized[key])
+        results.append(
+            {"key": key, "user": user_model(user) if user is not None else None}
+        )
 
-        user_exists = collection.find_one({"email": normalized_email})
-        if not user_exists:
-            update_dict = {"username": update_data.username, "email": normalized_email}
-            collection.update_one({"_id": current_user["_id"]}, {"$set": update_dict})
+    return FastJSONResponse({"results": results})
 
-            updated_user = collection.find_one({"_id": current_user["_id"]})
-            return UserResponse(
-                id=str(updated_user["_id"]),  # type: ignore
-                username=updated_user["username"],  # type: ignore
-                email=updated_user["email"],  # type: ignore
-                created_at=updated_user["created_at"],  # type: ignore
-            )
 
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT, detail="Incorrect Credentials"
-            )
+@router.get("", response_model=UserPage)
+async def list_users(
+    after: None | str = None,
+    limit: int = Query(default=100, ge=1),
+    admin: dict = Depends(get_current_admin),
+) -> FastJSONResponse:
+    # keyset pagination: every page is an indexed range read on _id, unlike
+    # skip/limit which scans all the skipped users
+    if limit > get_settings().user_page_max:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail=f"At most {get_settings().user_page_max} users per page",
+        )
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="Invalid after",
+        )
+
+    # one extra user tells whether there is a next page
+    users = await get_user_repository().list_users(
+        ObjectId(after) if after is not None else None, limit + 1
+    )
+    page = users[:limit]
+    next_after = str(page[-1]["_id"]) if len(users) > limit else None
+
+    return FastJSONResponse(
+        {"users": [user_model(user) for user in page], "next": next_after}
+    )
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_users(admin: dict = Depends(get_current_admin)) -> StreamingResponse:
+    # every user as NDJSON, streamed from one cursor: memory stays flat whatever
+    # the size of the collection
+    batch_size = get_settings().user_export_batch_size
+    users = get_user_repository().iter_users(batch_size)
+
+    return StreamingResponse(
+        ndjson_users(users, batch_size), media_type="application/x-ndjson"
+    )
 
 
 @router.delete("/me", status_code=204)
-def delete_my_profile(current_user: dict = Depends(get_current_user)):
-    collection = get_collection("users")
-    deleting_result = collection.delete_one({"_id": current_user["_id"]})
+async def delete_my_profile(current_user: dict = Depends(get_current_user)):
+    deleted = await get_user_repository().delete(current_user["_id"])
+    user_cache.pop(str(current_user["_id"]))
+    await outdate_profile_claims(str(current_user["_id"]))
 
-    if deleting_result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
         )
@@ -0,0 +1,24 @@
+"""
+module: wellknown.py
+purpose: public discovery endpoints for other services
+"""
+
+from fastapi import APIRouter, Request, Response, status
+from app.utils.security import get_jwks
+from app.config import get_settings
+from app.utils.responses import etag_matches
+
+router = APIRouter(prefix="/.well-known")
+
+@router.get("/jwks.json")
+def get_jwks_document(request: Request):
+    body, etag = get_jwks()
+    headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={get_settings().jwks_max_age}"
+            }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
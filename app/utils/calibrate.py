@@ -0,0 +1,49 @@
+"""
+module: calibrate.py
+purpose: pick the bcrypt cost for a target hashing time on this machine
+
+usage: python -m app.utils.calibrate --target-ms 250
+"""
+
+from app.utils.security import hash_password
+import argparse
+import time
+
+# bcrypt accepts costs from 4 to 31, every step doubles the work
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+def measure_hash(rounds: int, samples: int = 3) -> float:
+    # best of a few runs, in milliseconds, so a busy moment doesn't skew it
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hash_password("calibration password", rounds)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return min(timings)
+
+def calibrate(target_ms: float, measure=measure_hash) -> tuple[int, float]:
+    # highest cost whose hash still fits in the target, never below the minimum
+    rounds = MIN_ROUNDS
+    elapsed = measure(rounds)
+    while rounds < MAX_ROUNDS:
+        next_elapsed = measure(rounds + 1)
+        if next_elapsed > target_ms:
+            break
+        rounds += 1
+        elapsed = next_elapsed
+
+    return rounds, elapsed
+
+def main(argv: None|list = None):
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost for a target hashing time")
+    parser.add_argument("--target-ms", type=float, default=250, help="time budget for one hash, in milliseconds")
+    args = parser.parse_args(argv)
+
+    rounds, elapsed = calibrate(args.target_ms)
+    print(f"cost {rounds} takes {elapsed:.1f} ms per hash on this machine")
+    print(f"BCRYPT_ROUNDS={rounds}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+module: clients.py
+purpose: machine clients (other services) and their client-credentials tokens
+
+usage: python -m app.utils.clients billing users:lookup
+prints a new secret for the client and its SERVICE_CLIENTS entry
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+from fastapi import HTTPException, status
+from app.config import Settings, get_settings
+from app.utils.security import create_access_token
+from app.utils.revocation import revocation_list
+import argparse
+import hashlib
+import hmac
+import secrets
+import time
+import uuid
+
+@dataclass(frozen=True)
+class ServiceClient:
+    client_id: str
+    secret_digest: str
+    scopes: frozenset
+
+def client_secret_digest(secret: str, key: str) -> str:
+    # client secrets are long random strings, a keyed hash is enough to store
+    # them: no bcrypt cost on every token request
+    return hmac.new(key.encode(), secret.encode(), hashlib.sha256).hexdigest()
+
+class ClientRegistry:
+    """
+    SERVICE_CLIENTS="client_id=digest:scope scope,client_id=digest:scope", the
+    digest being client_secret_digest(secret, CLIENT_SECRET_KEY)
+    """
+
+    def __init__(self, settings: Settings):
+        self.clients = {}
+        for entry in settings.service_clients.split(","):
+            if not entry.strip():
+                continue
+
+            client_id, _, value = entry.strip().partition("=")
+            digest, _, scopes = value.partition(":")
+            if not client_id or not digest:
+                raise ValueError(f"Invalid SERVICE_CLIENTS entry: {client_id or entry}")
+            self.clients[client_id] = ServiceClient(client_id, digest, frozenset(scopes.split()))
+
+        if self.clients and not settings.client_secret_key:
+            raise ValueError("CLIENT_SECRET_KEY is not configured in the environment variables")
+        self.key = settings.client_secret_key or ""
+
+    def authenticate(self, client_id: str, secret: str) -> None|ServiceClient:
+        client = self.clients.get(client_id)
+        # the digest is computed for unknown clients too, so both take the same time
+        digest = client_secret_digest(secret, self.key)
+        if client is None or not hmac.compare_digest(digest, client.secret_digest):
+            return None
+
+        return client
+
+class ClientTokenCache:
+    """
+    signed tokens by client and scopes. a token is handed out again until
+    refresh_margin seconds before it expires, so a fleet of callers asking for
+    tokens costs one signature per client and token lifetime
+    """
+
+    def __init__(self, lifetime: float, refresh_margin: float):
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self.issued = 0
+        self.reused = 0
+
+    def get(self, client: ServiceClient, scopes: frozenset) -> tuple[str, int]:
+        key = (client.client_id, scopes)
+        now = time.time()
+
+        cached = self._tokens.get(key)
+        if cached is not None:
+            token, jti, expires_at = cached
+            if expires_at - self.refresh_margin > now and not revocation_list.is_revoked(jti):
+                self.reused += 1
+                return token, int(expires_at - now)
+
+        jti = uuid.uuid4().hex
+        token = create_access_token({
+            "sub": client.client_id,
+            "client_id": client.client_id,
+            "scope": " ".join(sorted(scopes)),
+            "jti": jti
+            }, expire_delta=timedelta(seconds=self.lifetime))
+        self._tokens[key] = (token, jti, now + self.lifetime)
+        self.issued += 1
+
+        return token, int(self.lifetime)
+
+_state = None
+
+def get_clients() -> tuple[ClientRegistry, ClientTokenCache]:
+    # rebuilt when the settings change, the cached tokens go with the old ones
+    global _state
+    settings = get_settings()
+    if _state is None or _state[0] is not settings:
+        try:
+            registry = ClientRegistry(settings)
+        except ValueError:
+            raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Server configuration error"
+                    )
+        tokens = ClientTokenCache(
+                lifetime=settings.access_token_expire_time * 60,
+                refresh_margin=settings.client_token_refresh_margin
+                )
+        _state = (settings, registry, tokens)
+
+    return _state[1], _state[2]
+
+def issue_client_token(client_id: str, secret: str, scope: None|str) -> dict:
+    registry, tokens = get_clients()
+
+    client = registry.authenticate(client_id, secret)
+    if client is None:
+        raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="invalid_client",
+                headers={"WWW-Authenticate": "Basic"}
+                )
+
+    # every allowed scope by default, otherwise a subset of them
+    scopes = client.scopes if scope is None else frozenset(scope.split())
+    if not scopes <= client.scopes:
+        raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="invalid_scope"
+                )
+
+    token, expires_in = tokens.get(client, scopes)
+
+    return {
+            "access_token": token,
+            "token_type": "bearer",
+            "expires_in": expires_in,
+            "scope": " ".join(sorted(scopes))
+            }
+
+def main(argv: None|list = None):
+    parser = argparse.ArgumentParser(description="Create the secret of a machine client")
+    parser.add_argument("client_id")
+    parser.add_argument("scopes", nargs="*")
+    args = parser.parse_args(argv)
+
+    key = get_settings().client_secret_key
+    if not key:
+        parser.error("CLIENT_SECRET_KEY is not configured in the environment variables")
+
+    secret = secrets.token_urlsafe(32)
+    print(f"client secret (give it to the client, it is not stored): {secret}")
+    print(f"SERVICE_CLIENTS entry: {args.client_id}={client_secret_digest(secret, key)}:{' '.join(args.scopes)}")
+
+if __name__ == "__main__":
+    main()
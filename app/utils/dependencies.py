@@ -5,18 +5,99 @@ purpose: utility functions needed for endpoints
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.config import get_settings
 from app.utils.security import verify_token
-from app.database import get_collection
-from bson import ObjectId
+from app.repository import get_user_repository
+from app.utils.cache import TTLCache
+from app.utils.revocation import revocation_list
+from datetime import datetime
 
 security = HTTPBearer()
 
+# user documents by user id, kept in sync by the write endpoints in users.py.
+# configured from the settings by create_app
+user_cache = TTLCache(maxsize=10000, ttl=60)
+
+async def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    return verify_token(credentials.credentials)
+
+async def get_service_client(payload: dict = Depends(get_token_payload)) -> dict:
+    # internal endpoints: only client credentials tokens (other services) carry client_id
+    if not payload.get("client_id"):
+        raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Service token required"
+                )
+
+    return payload
+
+def require_scope(scope: str):
+    # a service endpoint: the client token must have been granted the scope
+    async def dependency(service: dict = Depends(get_service_client)) -> dict:
+        if scope not in service.get("scope", "").split():
+            raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail=f"Scope {scope} required",
+                    headers={"WWW-Authenticate": f'Bearer error="insufficient_scope", scope="{scope}"'}
+                    )
+
+        return service
+
+    return dependency
+
+def verify_user_token(token: str) -> dict:
+    # user endpoints: the sub of a client token is a client id, not a user
+    payload = verify_token(token)
+    if payload.get("client_id"):
+        raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="User token required"
+                )
+
+    return payload
+
+def profile_from_claims(payload: dict) -> None|dict:
+    # the profile embedded in the token, unless the mode is off, the token has no
+    # profile claims or the profile has changed (or is gone) since it was issued
+    if not get_settings().profile_claims or "pv" not in payload:
+        return None
+
+    if revocation_list.is_profile_outdated(payload["sub"], payload["pv"]):
+        return None
+
+    return {
+            "_id": payload["sub"],
+            "email": payload["email"],
+            "username": payload["username"],
+            "created_at": datetime.fromisoformat(payload["created_at"]),
+            "profile_version": payload["pv"]
+            }
+
+async def get_current_profile(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # read-only endpoints: no I/O when the token carries an up to date profile
+    payload = verify_user_token(credentials.credentials)
+
+    return profile_from_claims(payload) or await load_user(payload)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = verify_user_token(credentials.credentials)
 
-    try:
-        token = credentials.credentials
-        payload = verify_token(token)
+    return await load_user(payload)
+
+async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # the role is read from the user document, tokens don't carry it
+    user = await get_current_user(credentials)
+    if user.get("role") != "admin":
+        raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Admin role required"
+                )
 
+    return user
+
+async def load_user(payload: dict) -> dict:
+
+    try:
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(
@@ -24,15 +105,18 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                     detail="Invalid Token: it does not have user_id"
                     )
         
-        collection = get_collection("users")
-        user = collection.find_one({"_id":ObjectId(user_id)})
-        if not user:
-            raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User Not Found"
-                    )
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await get_user_repository().find_by_id(user_id)
+            if not user:
+                raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="User Not Found"
+                        )
+
+            user_cache.set(user_id, user)
 
-        return user
+        return dict(user)
 
     except Exception as e:
         raise e
@@ -0,0 +1,248 @@
+"""
+module: idempotency.py
+purpose: Idempotency-Key support, the first response to a key is replayed to its retries
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, Response, status
+from pymongo.errors import DuplicateKeyError
+from app.database import get_collection
+from app.utils.cache import TTLCache
+from app.utils.responses import FastJSONResponse
+import asyncio
+import hashlib
+import uuid
+
+# longer keys are rejected, they are client supplied and end up in memory and in mongo
+MAX_KEY_LENGTH = 255
+
+# seconds a key stays reserved in mongo without a response, in case its worker
+# died, and seconds between two looks of the requests waiting for it
+PENDING_TTL = 60
+PENDING_POLL_INTERVAL = 0.05
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: bytes
+    headers: dict
+
+    def to_response(self) -> Response:
+        response = Response(content=self.body, status_code=self.status_code, headers=self.headers)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+def fingerprint(*parts: str) -> str:
+    # identifies the request a key was first used with, without keeping its content
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+class IdempotencyStore:
+    """
+    the first request with a key does the work, its final response (anything but
+    a 5xx, which the client should be able to retry) is kept for ttl seconds and
+    replayed to every later request with the key. concurrent requests with the
+    key wait for the one in flight instead of doing the work twice.
+
+    responses live in a TTL bounded LRU of this worker, and with mongo backing
+    also in the idempotency_keys collection so retries landing on another worker
+    are replayed too. there the key is reserved before the work starts, and
+    duplicates on other workers poll the reservation until it holds a response
+    """
+
+    collection_name = "idempotency_keys"
+
+    def __init__(self, maxsize: int, ttl: float, mongo: bool = False):
+        self.ttl = ttl
+        self.mongo = mongo
+
+        self._responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = {}
+        self._replayed = 0
+
+    def configure(self, maxsize: int, ttl: float, mongo: bool):
+        self._responses.clear()
+        self._responses.maxsize = maxsize
+        self._responses.ttl = ttl
+        self.ttl = ttl
+        self.mongo = mongo
+
+    async def run(self, key: str, request_fingerprint: str, handler) -> Response:
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Idempotency-Key is too long"
+                    )
+
+        while True:
+            stored = self._responses.get(key) or await self._load(key)
+            if stored is not None:
+                return self._replay(stored, request_fingerprint)
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                # whatever the first request ends with, look again: its response is
+                # stored, or it failed and this request does the work
+                await asyncio.wait([in_flight])
+                continue
+
+            in_flight = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = in_flight
+            try:
+                owner = await self._reserve(key, request_fingerprint)
+                if owner is not None:
+                    return await self._complete(key, owner, request_fingerprint, handler)
+
+                # another worker holds the key: replay its response once stored, or
+                # look again if it gave the key up
+                stored = await self._wait_for(key)
+                if stored is not None:
+                    return self._replay(stored, request_fingerprint)
+            finally:
+                del self._in_flight[key]
+                in_flight.set_result(None)
+
+    async def _complete(self, key: str, owner: str, request_fingerprint: str, handler) -> Response:
+        try:
+            response = await self._respond(handler)
+        except BaseException:
+            await self._release(key, owner)
+            raise
+
+        if response.status_code >= 500:
+            await self._release(key, owner)
+            return response
+
+        stored = StoredResponse(
+                fingerprint=request_fingerprint,
+                status_code=response.status_code,
+                body=bytes(response.body),
+                headers={
+                    name: value for name, value in response.headers.items()
+                    if name != "content-length"
+                    }
+                )
+        first = await self._save(key, owner, stored)
+        if first is not stored:
+            # another worker answered this key first, its response is the one kept
+            return self._replay(first, request_fingerprint)
+
+        return response
+
+    async def _respond(self, handler) -> Response:
+        # expected errors (409...) are answers to store too
+        try:
+            return await handler()
+        except HTTPException as exc:
+            if exc.status_code >= 500:
+                raise
+            return FastJSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+    def _replay(self, stored: StoredResponse, request_fingerprint: str) -> Response:
+        if stored.fingerprint != request_fingerprint:
+            raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                    detail="Idempotency-Key already used with a different request"
+                    )
+
+        self._replayed += 1
+        return stored.to_response()
+
+    def _stored(self, key: str, document: dict) -> StoredResponse:
+        stored = StoredResponse(
+                fingerprint=document["fingerprint"],
+                status_code=document["status_code"],
+                body=document["body"],
+                headers=document["headers"]
+                )
+        expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+        self._responses.set(key, stored, ttl=(expires_at - datetime.now(timezone.utc)).total_seconds())
+        return stored
+
+    async def _load(self, key: str) -> None|StoredResponse:
+        # the stored response of the key, None while it is only reserved
+        if not self.mongo:
+            return None
+
+        document = await get_collection(self.collection_name).find_one({"_id": key})
+        if document is None or document.get("state") == "pending":
+            return None
+
+        return self._stored(key, document)
+
+    async def _reserve(self, key: str, request_fingerprint: str) -> None|str:
+        # claims the key for every worker before the work starts, returns the
+        # owner id of the reservation or None when another request holds it
+        owner = uuid.uuid4().hex
+        if not self.mongo:
+            return owner
+
+        try:
+            await get_collection(self.collection_name).insert_one({
+                "_id": key,
+                "state": "pending",
+                "owner": owner,
+                "fingerprint": request_fingerprint,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=PENDING_TTL)
+                })
+        except DuplicateKeyError:
+            return None
+
+        return owner
+
+    async def _wait_for(self, key: str) -> None|StoredResponse:
+        # polls the reservation of another worker until it holds a response, or
+        # is gone: given up after a 5xx, or expired with a worker that died
+        collection = get_collection(self.collection_name)
+        while True:
+            document = await collection.find_one({"_id": key})
+            if document is None:
+                return None
+            if document.get("state") != "pending":
+                return self._stored(key, document)
+
+            if document["expires_at"].replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+                await collection.delete_one({"_id": key, "owner": document["owner"], "state": "pending"})
+                return None
+
+            await asyncio.sleep(PENDING_POLL_INTERVAL)
+
+    async def _release(self, key: str, owner: str):
+        # the request can be retried: the reservation goes away without a response
+        if self.mongo:
+            await get_collection(self.collection_name).delete_one({"_id": key, "owner": owner, "state": "pending"})
+
+    async def _save(self, key: str, owner: str, stored: StoredResponse) -> StoredResponse:
+        if self.mongo:
+            collection = get_collection(self.collection_name)
+            result = await collection.replace_one({"_id": key, "owner": owner, "state": "pending"}, {
+                "state": "done",
+                "fingerprint": stored.fingerprint,
+                "status_code": stored.status_code,
+                "body": stored.body,
+                "headers": stored.headers,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+                })
+            if result.matched_count == 0:
+                # the reservation expired and another request took the key over
+                first = await self._load(key)
+                if first is not None:
+                    return first
+
+        self._responses.set(key, stored)
+        return stored
+
+    def clear(self):
+        self._responses.clear()
+        self._replayed = 0
+
+    def stats(self) -> dict:
+        return {
+                "responses": len(self._responses),
+                "in_flight": len(self._in_flight),
+                "replayed": self._replayed
+                }
+
+# configured from the settings by create_app
+idempotency_store = IdempotencyStore(maxsize=10000, ttl=86400)
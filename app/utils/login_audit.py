@@ -0,0 +1,129 @@
+"""
+module: login_audit.py
+purpose: login history and last_login_at, written in batches off the login path
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+from app.database import get_collection
+from app.repository import get_user_repository
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LoginAudit:
+    """
+    login_user only appends an event to a bounded in-process queue. a background
+    task writes the events with one insert_many into login_events, and the
+    last_login_at of their users with one coalesced bulk update, every
+    batch_size events or flush_interval seconds. when the queue is full new
+    events are dropped (and counted) rather than slowing logins down, and the
+    queue is drained when the worker stops. in memory mode only last_login_at
+    is written, the events themselves are not kept
+    """
+
+    collection_name = "login_events"
+
+    def __init__(self, batch_size: int, flush_interval: float, queue_size: int, memory: bool = False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.memory = memory
+
+        self._events = deque()
+        self._wakeup = None
+        self._stopping = False
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+
+    def configure(self, batch_size: int, flush_interval: float, queue_size: int, memory: bool):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.memory = memory
+
+    def record(self, user_id, email: str, success: bool, ip: None|str):
+        if len(self._events) >= self.queue_size:
+            self._dropped += 1
+            return
+
+        self._events.append({
+            "user_id": user_id,
+            "email": email,
+            "success": success,
+            "ip": ip,
+            "at": datetime.now(timezone.utc)
+            })
+        if len(self._events) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        while self._events:
+            batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+            try:
+                await self._write(batch)
+                self._written += len(batch)
+            except Exception:
+                # the batch is lost, the next ones are still written
+                self._failed += len(batch)
+                logger.exception("could not write %s login events", len(batch))
+            self._batches += 1
+
+    async def _write(self, batch: list):
+        if not self.memory:
+            await get_collection(self.collection_name).insert_many(batch, ordered=False)
+
+        # one update per user, with the latest of its logins in the batch
+        last_logins = {}
+        for event in batch:
+            if event["success"]:
+                user_id = event["user_id"]
+                last_logins[user_id] = max(event["at"], last_logins.get(user_id, event["at"]))
+        if last_logins:
+            await get_user_repository().record_last_logins(last_logins)
+
+    async def run(self):
+        # the event belongs to the loop of this worker, it is created here
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        try:
+            while not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+
+            await self.flush()
+        finally:
+            self._wakeup = None
+
+    def stop(self):
+        # run() writes what is left in the queue, then returns
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def clear(self):
+        self._events.clear()
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+
+    def stats(self) -> dict:
+        return {
+                "queued": len(self._events),
+                "queue_size": self.queue_size,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "batches": self._batches
+                }
+
+# configured from the settings by create_app
+login_audit = LoginAudit(batch_size=500, flush_interval=0.2, queue_size=10000)
@@ -0,0 +1,302 @@
+"""
+module: metrics.py
+purpose: lightweight prometheus style metrics: histograms, gauges, the request
+middleware and the mongo command listener
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in zip(label_names, label_values)
+            ]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Histogram:
+    """
+    fixed bucket histogram, observe() is a bisect plus two additions under a lock
+    so it is cheap enough for every request and safe from worker threads
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+
+        for label_values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.label_names, label_values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+class Gauge:
+    """
+    gauge set directly (inc/dec) or read at scrape time from a function that
+    returns {label_values: value}, used to export the stats of the pools and caches
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), function=None, kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.function = function
+        self.kind = kind
+
+        self._values = {} if label_names else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+        if self.function is not None:
+            values = self.function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+        "http_request_duration_seconds",
+        "Latency of the HTTP requests by route",
+        ("method", "route", "status")
+        ))
+requests_in_flight = registry.register(Gauge(
+        "http_requests_in_flight",
+        "HTTP requests being served"
+        ))
+password_hash_duration = registry.register(Histogram(
+        "password_hash_duration_seconds",
+        "Time spent in bcrypt, without the queue wait",
+        ("operation",)
+        ))
+jwt_duration = registry.register(Histogram(
+        "jwt_duration_seconds",
+        "Time spent encoding and decoding tokens",
+        ("operation",)
+        ))
+password_pool_wait = registry.register(Histogram(
+        "password_pool_wait_seconds",
+        "Time password hashing jobs wait in the queue before a worker picks them up"
+        ))
+mongo_pool_checkout_wait = registry.register(Histogram(
+        "mongo_pool_checkout_wait_seconds",
+        "Time spent waiting to check a connection out of the mongo pool",
+        ("outcome",)
+        ))
+mongo_command_duration = registry.register(Histogram(
+        "mongo_command_duration_seconds",
+        "Duration of the mongo commands by command and collection",
+        ("command", "collection", "outcome")
+        ))
+
+class MetricsMiddleware:
+    """
+    plain ASGI middleware (cheaper than BaseHTTPMiddleware). the route label is the
+    path template of the matched route, so ids in the url don't create new series
+    """
+
+    def __init__(self, app, excluded_paths: tuple = ("/metrics",)):
+        self.app = app
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_flight.dec()
+            route = scope.get("route")
+            request_duration.observe(
+                    time.perf_counter() - started,
+                    scope["method"],
+                    getattr(route, "path", "unmatched"),
+                    str(status_code)
+                    )
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    times every command sent through the client, so every operation issued on a
+    collection from get_collection is covered without wrapping the collections
+    """
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._collections[event.request_id] = collection
+
+    def _record(self, event, outcome: str):
+        with self._lock:
+            collection = self._collections.pop(event.request_id, "")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, event.command_name, collection, outcome)
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    records how long operations wait for a pooled connection and how many
+    connections are checked out, to size maxPoolSize and waitQueueTimeoutMS
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _record_wait(self, duration: None|float, outcome: str):
+        duration = duration or 0.0
+        mongo_pool_checkout_wait.observe(duration, outcome)
+        with self._lock:
+            self._wait_total += duration
+            self._wait_max = max(self._wait_max, duration)
+            if outcome == "success":
+                self.checkouts += 1
+                self.checked_out += 1
+            else:
+                self.failures += 1
+
+    def connection_checked_out(self, event):
+        self._record_wait(event.duration, "success")
+
+    def connection_check_out_failed(self, event):
+        self._record_wait(event.duration, "failure")
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + self.failures
+            return {
+                    "checked_out": self.checked_out,
+                    "checkouts": self.checkouts,
+                    "failures": self.failures,
+                    "wait_ms_avg": round(self._wait_total / attempts * 1000, 3) if attempts else 0.0,
+                    "wait_ms_max": round(self._wait_max * 1000, 3)
+                    }
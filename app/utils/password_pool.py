@@ -0,0 +1,112 @@
+"""
+module: password_pool.py
+purpose: bounded worker pool for bcrypt hashing and checking
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from app.utils.metrics import password_pool_wait
+import asyncio
+import threading
+import time
+import os
+
+class PasswordPool:
+    """
+    bcrypt releases the GIL while it works, so a dedicated thread pool is enough
+    to keep hashing off the event loop and out of starlette's shared threadpool.
+    jobs beyond workers + queue_size are rejected with a 503 instead of piling up
+    """
+
+    def __init__(self, workers: int, queue_size: int, retry_after: int = 1):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def configure(self, workers: int, queue_size: int, retry_after: int):
+        self.shutdown()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # created on first use, and again in a forked worker: threads don't survive a fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="password-pool"
+                    )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run_job(self, submitted_at: float, func, args):
+        waited = time.perf_counter() - submitted_at
+        password_pool_wait.observe(waited)
+        with self._lock:
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        return func(*args)
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled():
+                self._completed += 1
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Server busy, try again later",
+                        headers={"Retry-After": str(self.retry_after)}
+                        )
+            self._pending += 1
+
+        try:
+            future = self._get_executor().submit(self._run_job, time.perf_counter(), func, args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        future.add_done_callback(self._release)
+
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            completed = self._completed
+            wait_avg = self._wait_total / completed if completed else 0.0
+
+            return {
+                    "workers": self.workers,
+                    "queue_size": self.queue_size,
+                    "in_flight": pending,
+                    "queue_depth": max(0, pending - self.workers),
+                    "completed": completed,
+                    "rejected": self._rejected,
+                    "wait_ms_avg": round(wait_avg * 1000, 3),
+                    "wait_ms_max": round(self._wait_max * 1000, 3)
+                    }
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
+        self._executor_pid = None
+
+# configured from the settings by create_app
+password_pool = PasswordPool(workers=os.cpu_count() or 4, queue_size=64)
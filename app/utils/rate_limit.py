@@ -0,0 +1,188 @@
+"""
+module: rate_limit.py
+purpose: token-bucket throttling of login attempts, per email and per client ip
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from app.database import get_collection
+import hashlib
+import math
+import threading
+import time
+
+class MemoryBucketStore:
+    """
+    buckets of this worker, split in shards with their own lock so concurrent
+    attempts on different keys don't wait for each other. every shard is an LRU
+    bounded to max_buckets / shards entries, and a bucket that has been idle long
+    enough to be full again is dropped: it behaves exactly like a missing one
+    """
+
+    def __init__(self, max_buckets: int = 100000, shards: int = 16, clock=time.monotonic):
+        self.shards = shards
+        self.max_buckets = max_buckets
+        self.clock = clock
+
+        self._buckets = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._evictions = 0
+
+    def _shard(self, key: str) -> int:
+        return hash(key) % self.shards
+
+    async def take(self, key: str, capacity: float, per_second: float) -> float:
+        # takes one token, returns 0 when allowed or the seconds until a token is available
+        now = self.clock()
+        shard = self._shard(key)
+        buckets = self._buckets[shard]
+        shard_size = max(1, self.max_buckets // self.shards)
+
+        with self._locks[shard]:
+            tokens, updated_at, _ = buckets.pop(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated_at) * per_second)
+
+            if tokens >= 1:
+                retry_after = 0.0
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / per_second
+
+            # the time it is full again is kept, buckets of both kinds share the shards
+            buckets[key] = (tokens, now, now + (capacity - tokens) / per_second)
+
+            # the least recently used buckets sit at the front, drop them while they
+            # are full again, then enforce the bound
+            while buckets and next(iter(buckets.values()))[2] <= now:
+                buckets.popitem(last=False)
+            while len(buckets) > shard_size:
+                buckets.popitem(last=False)
+                self._evictions += 1
+
+        return retry_after
+
+    def clear(self):
+        for shard, lock in zip(self._buckets, self._locks):
+            with lock:
+                shard.clear()
+        self._evictions = 0
+
+    def stats(self) -> dict:
+        return {
+                "buckets": sum(len(shard) for shard in self._buckets),
+                "max_buckets": self.max_buckets,
+                "evictions": self._evictions
+                }
+
+class MongoBucketStore:
+    """
+    buckets shared by every worker, in the login_buckets collection. each attempt
+    is a single atomic pipeline update (refill, then take), and the TTL index on
+    expires_at drops a bucket once it would be full again
+    """
+
+    collection_name = "login_buckets"
+
+    async def take(self, key: str, capacity: float, per_second: float) -> float:
+        now = datetime.now(timezone.utc)
+        idle_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [idle_seconds, per_second]}]}]}
+
+        collection = get_collection(self.collection_name)
+        bucket = await collection.find_one_and_update(
+                {"_id": hashlib.sha256(key.encode()).hexdigest()},
+                [
+                    {"$set": {"tokens": refilled, "updated_at": now}},
+                    {"$set": {
+                        "allowed": {"$gte": ["$tokens", 1]},
+                        "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                        "expires_at": now + timedelta(seconds=capacity / per_second)
+                        }}
+                    ],
+                projection={"tokens": 1, "allowed": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+                )
+
+        if bucket["allowed"]:
+            return 0.0
+
+        return (1 - bucket["tokens"]) / per_second
+
+    def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"buckets": None}
+
+class LoginThrottle:
+    """
+    a credential-stuffing burst would otherwise cost one bcrypt check per attempt.
+    every attempt takes a token from the bucket of its email and of its client
+    ip, and is rejected with a 429 before any lookup or hashing when one is empty.
+    a capacity of 0 disables the limit of that key
+    """
+
+    def __init__(self, store, email_capacity: float = 5, email_per_minute: float = 5,
+                 ip_capacity: float = 20, ip_per_minute: float = 60):
+        self.store = store
+        self.email_capacity = email_capacity
+        self.email_per_minute = email_per_minute
+        self.ip_capacity = ip_capacity
+        self.ip_per_minute = ip_per_minute
+
+        self._rejected = {"email": 0, "ip": 0}
+
+    def configure(self, store, email_capacity: float, email_per_minute: float,
+                  ip_capacity: float, ip_per_minute: float):
+        self.store = store
+        self.email_capacity = email_capacity
+        self.email_per_minute = email_per_minute
+        self.ip_capacity = ip_capacity
+        self.ip_per_minute = ip_per_minute
+
+    async def check(self, email: str, ip: None|str):
+        # the address first: the email bucket is only charged once it has passed,
+        # otherwise a throttled address could keep draining the buckets of any
+        # account and lock its owner out
+        limits = [
+                ("ip", ip, self.ip_capacity, self.ip_per_minute),
+                ("email", email, self.email_capacity, self.email_per_minute)
+                ]
+
+        for kind, value, capacity, per_minute in limits:
+            if not capacity or value is None:
+                continue
+
+            retry_after = await self.store.take(f"{kind}:{value}", capacity, per_minute / 60)
+            if retry_after:
+                self._rejected[kind] += 1
+                raise HTTPException(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail="Too many login attempts, try again later",
+                        headers={"Retry-After": str(math.ceil(retry_after))}
+                        )
+
+    def clear(self):
+        self.store.clear()
+        self._rejected = {"email": 0, "ip": 0}
+
+    def stats(self) -> dict:
+        return {
+                **self.store.stats(),
+                "rejected_email": self._rejected["email"],
+                "rejected_ip": self._rejected["ip"]
+                }
+
+def bucket_store(backend: str, max_buckets: int):
+    if backend == "memory":
+        return MemoryBucketStore(max_buckets=max_buckets)
+    if backend == "mongo":
+        return MongoBucketStore()
+
+    raise ValueError(f"Unknown login throttle backend: {backend}")
+
+# configured from the settings by create_app
+login_throttle = LoginThrottle(MemoryBucketStore())
@@ -0,0 +1,65 @@
+"""
+module: responses.py
+purpose: JSON responses serialized once, by pydantic's compiled serializers
+"""
+
+from typing import Any
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+from app.models import UserResponse
+
+# built once at import: dumps dicts, lists and datetimes straight to JSON bytes
+json_adapter = TypeAdapter(Any)
+
+class FastJSONResponse(JSONResponse):
+    """
+    a response returned by a handler is sent as is: fastapi skips the second
+    validation against response_model and the jsonable_encoder pass, which stay
+    on the routes for the OpenAPI schema only
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.__pydantic_serializer__.to_json(content)
+
+        return json_adapter.dump_json(content)
+
+def etag_matches(if_none_match: None|str, etag: str) -> bool:
+    # If-None-Match holds one or more tags, or *, compared weakly (RFC 9110)
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+def user_etag(user: dict) -> str:
+    # every profile update bumps the version, so id and version identify the body
+    return f'"{user["_id"]}-{user.get("profile_version", 0)}"'
+
+def user_model(user: dict) -> UserResponse:
+    # the document comes from our own database (or a verified token), it was
+    # validated on its way in and is not validated again on its way out
+    return UserResponse.model_construct(
+            id=str(user["_id"]),
+            username=user["username"],
+            email=user["email"],
+            created_at=user["created_at"]
+            )
+
+async def ndjson_users(users, chunk_size: int):
+    # one UserResponse per line, sent chunk_size lines at a time so a large export
+    # is neither held in memory nor written one tiny chunk per user
+    lines = []
+    async for user in users:
+        lines.append(UserResponse.__pydantic_serializer__.to_json(user_model(user)))
+        if len(lines) >= chunk_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+def user_response(user: dict, status_code: int = 200, headers: None|dict = None) -> FastJSONResponse:
+    return FastJSONResponse(user_model(user), status_code=status_code, headers=headers)
@@ -0,0 +1,117 @@
+"""
+module: revocation.py
+purpose: revoked tokens store (mongo) and its in-memory copy used by verify_token
+"""
+
+from app.database import get_collection
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# revocations written by other workers can land slightly out of order, so every
+# refresh re-reads this much history before the last one it saw
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+def outdated_profile_key(user_id: str, version: None|int = None) -> str:
+    # kept next to the token ids: the profile claims of the user's tokens carrying
+    # this version are stale, or those of all its tokens once it is deleted
+    if version is None:
+        return f"profile:{user_id}"
+
+    return f"profile:{user_id}:{version}"
+
+class RevocationList:
+    """
+    every worker keeps the ids (jti) of the revoked, not yet expired tokens in a
+    hash set, so checking a token costs no network I/O. the set is refreshed
+    incrementally from the revoked_tokens collection, whose TTL index drops the
+    documents once the token would have expired anyway
+    """
+
+    def __init__(self, refresh_interval: float, memory: bool = False):
+        self.refresh_interval = refresh_interval
+        # revocations of this process only, nothing is read from or written to mongo
+        self.memory = memory
+
+        self._revoked = {}
+        self._last_revoked_at = None
+
+    def is_revoked(self, jti: None|str) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def is_profile_outdated(self, user_id: str, version: int) -> bool:
+        return (outdated_profile_key(user_id) in self._revoked
+                or outdated_profile_key(user_id, version) in self._revoked)
+
+    def add(self, jti: str, expires_at: float):
+        self._revoked[jti] = expires_at
+
+    async def revoke(self, jti: str, expires_at: datetime):
+        if not self.memory:
+            collection = get_collection("revoked_tokens")
+            try:
+                await collection.insert_one({
+                    "jti": jti,
+                    "expires_at": expires_at,
+                    "revoked_at": datetime.now(timezone.utc)
+                    })
+            except DuplicateKeyError:
+                # already revoked, by this worker or another one
+                pass
+
+        self.add(jti, expires_at.timestamp())
+
+    async def outdate_profile(self, user_id: str, version: None|int, expires_at: datetime):
+        # reaches every worker with the next refresh, the tokens affected are then
+        # answered from the database. expires_at is when the last of them expires
+        await self.revoke(outdated_profile_key(user_id, version), expires_at)
+
+    async def refresh(self):
+        if self.memory:
+            self._prune()
+            return
+
+        collection = get_collection("revoked_tokens")
+
+        query = {}
+        if self._last_revoked_at is not None:
+            query = {"revoked_at": {"$gte": self._last_revoked_at - REFRESH_OVERLAP}}
+
+        cursor = collection.find(query, {"_id": 0, "jti": 1, "expires_at": 1, "revoked_at": 1})
+        async for document in cursor:
+            expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+            revoked_at = document["revoked_at"].replace(tzinfo=timezone.utc)
+
+            self.add(document["jti"], expires_at.timestamp())
+            if self._last_revoked_at is None or revoked_at > self._last_revoked_at:
+                self._last_revoked_at = revoked_at
+
+        self._prune()
+
+    def _prune(self):
+        now = time.time()
+        expired = [jti for jti, expires_at in self._revoked.items() if expires_at <= now]
+        for jti in expired:
+            del self._revoked[jti]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("could not refresh the revoked tokens")
+
+    def clear(self):
+        self._revoked.clear()
+        self._last_revoked_at = None
+
+    def __len__(self):
+        return len(self._revoked)
+
+# configured from the settings by create_app
+revocation_list = RevocationList(refresh_interval=5)
@@ -6,18 +6,26 @@ purpose: store utility functions for authentication and security
 import jwt
 from fastapi import HTTPException, status
 from jwt import ExpiredSignatureError, InvalidTokenError
+from jwt.algorithms import get_default_algorithms
 import bcrypt
 from datetime import timedelta, timezone, datetime
-import os
-from dotenv import load_dotenv
+from functools import lru_cache
+from cryptography.hazmat.primitives import serialization
+from app.config import Settings, get_settings
+from app.utils.cache import TTLCache
+from app.utils.revocation import revocation_list
+from app.utils.metrics import password_hash_duration, jwt_duration
+import hashlib
+import json
+import time
+import uuid
 
-load_dotenv()
-
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
+def hash_password(password: str, rounds: None|int = None) -> str:
+    salt = bcrypt.gensalt(rounds or get_settings().bcrypt_rounds)
     bytes_password = password.encode()
 
-    hashed_password = bcrypt.hashpw(bytes_password, salt)
+    with password_hash_duration.time("hash"):
+        hashed_password = bcrypt.hashpw(bytes_password, salt)
 
     hashed_password_str = hashed_password.decode()
     return hashed_password_str
@@ -26,53 +34,272 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_password_bytes = plain_password.encode()
     hashed_password_bytes = hashed_password.encode()
 
-    return bcrypt.checkpw(plain_password_bytes, hashed_password_bytes)
+    with password_hash_duration.time("verify"):
+        return bcrypt.checkpw(plain_password_bytes, hashed_password_bytes)
+
+def hash_cost(hashed_password: str) -> None|int:
+    # bcrypt hashes look like $2b$12$<salt and hash>, 12 being the cost
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+
+    return int(parts[2])
+
+def needs_rehash(hashed_password: str) -> bool:
+    cost = hash_cost(hashed_password)
+    return cost is not None and cost != get_settings().bcrypt_rounds
 
 # JWT utility functions
 
+ASYMMETRIC_ALGORITHMS = {
+        "RS256", "RS384", "RS512",
+        "PS256", "PS384", "PS512",
+        "ES256", "ES384", "ES512",
+        "EdDSA"
+        }
+
+# every algorithm a key may be configured with, "none" is never accepted
+SIGNING_ALGORITHMS = set(get_default_algorithms()) - {"none"}
+
+class SigningKey:
+    """
+    key material resolved once: the key tokens are signed with and the key they
+    are verified with. both are the same secret for HMAC algorithms, retired keys
+    only keep the verification key
+    """
+
+    def __init__(self, kid: str, algorithm: str, signing_key, verification_key):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.signing_key = signing_key
+        self.verification_key = verification_key
+
+    @property
+    def is_asymmetric(self) -> bool:
+        return self.algorithm in ASYMMETRIC_ALGORITHMS
+
+    def public_jwk(self) -> dict:
+        jwk_algorithm = jwt.get_algorithm_by_name(self.algorithm)
+        jwk = jwk_algorithm.to_jwk(self.verification_key, as_dict=True)
+        jwk.update({"kid": self.kid, "use": "sig", "alg": self.algorithm})
+
+        return jwk
+
+class KeyRing:
+    """
+    the active key signs new tokens, every key in the ring (active and retired)
+    verifies them, selected by the kid header
+    """
+
+    def __init__(self, active: SigningKey, retired: list[SigningKey]):
+        self.active = active
+        self.retired = retired
+        self.keys = {key.kid: key for key in retired}
+        self.keys[active.kid] = active
+
+    def get(self, kid: None|str, algorithm: None|str = None) -> SigningKey:
+        # tokens issued before kid headers existed were signed with the active key
+        # or, once it has been rotated, with the first retired key of their algorithm
+        if kid is None:
+            if algorithm is None or algorithm == self.active.algorithm:
+                return self.active
+            for key in self.retired:
+                if key.algorithm == algorithm:
+                    return key
+            raise InvalidTokenError("No key for the token algorithm")
+
+        key = self.keys.get(kid)
+        if key is None:
+            raise InvalidTokenError("Unknown key id")
+
+        return key
+
+def _derive_kid(material: bytes) -> str:
+    return hashlib.sha256(material).hexdigest()[:16]
+
+def _public_key_bytes(public_key) -> bytes:
+    return public_key.public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+
+def _read_private_key(settings: Settings) -> bytes:
+    if settings.private_key_path:
+        with open(settings.private_key_path, "rb") as key_file:
+            return key_file.read()
+
+    if not settings.private_key:
+        raise ValueError("PRIVATE_KEY_PATH or PRIVATE_KEY is not configured in the environment variables")
+
+    return settings.private_key.encode()
+
+def _load_active_key(settings: Settings) -> SigningKey:
+    algorithm = settings.algorithm
+    kid = settings.key_id
+
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        private_key = serialization.load_pem_private_key(_read_private_key(settings), password=None)
+        public_key = private_key.public_key()
+        kid = kid or _derive_kid(_public_key_bytes(public_key))
+        return SigningKey(kid, algorithm, private_key, public_key)
+
+    secret_key = settings.secret_key
+    if not secret_key:
+        raise ValueError("SECRET_KEY is not configured in the environment variables")
+
+    kid = kid or _derive_kid(secret_key.encode())
+    return SigningKey(kid, algorithm, secret_key, secret_key)
+
+def _load_retired_keys(settings: Settings) -> list[SigningKey]:
+    # RETIRED_KEYS="kid=alg:value,kid=value", value is the old secret for HMAC
+    # algorithms or the path to the old PEM public key for asymmetric ones. alg
+    # is the algorithm the key signed with, the current one when it is left out,
+    # so a rotation can also change the algorithm
+    retired = []
+    for entry in settings.retired_keys.split(","):
+        if not entry.strip():
+            continue
+
+        kid, _, value = entry.strip().partition("=")
+        algorithm, separator, key_value = value.partition(":")
+        if not separator or algorithm not in SIGNING_ALGORITHMS:
+            algorithm, key_value = settings.algorithm, value
+        if not kid or not key_value:
+            raise ValueError(f"Invalid RETIRED_KEYS entry: {kid or entry}")
+
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            with open(key_value, "rb") as key_file:
+                public_key = serialization.load_pem_public_key(key_file.read())
+            retired.append(SigningKey(kid, algorithm, None, public_key))
+        else:
+            retired.append(SigningKey(kid, algorithm, None, key_value))
+
+    return retired
+
+@lru_cache(maxsize=1)
+def get_key_ring() -> KeyRing:
+    settings = get_settings()
+
+    return KeyRing(_load_active_key(settings), _load_retired_keys(settings))
+
 def create_access_token(data: dict, expire_delta: None|timedelta = None) -> str:
     to_encode = data.copy()
 
     if expire_delta:
         expire = datetime.now(timezone.utc) + expire_delta
     else:
-        expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_TIME", 30))
+        expire_minutes = get_settings().access_token_expire_time
         expire = datetime.now(timezone.utc) + timedelta(minutes=expire_minutes)
 
     to_encode.update({"exp":expire})
-    
-    secret_key = os.getenv("SECRET_KEY")
-    if not secret_key:
-        raise ValueError("SECRET_KEY is not configured in the environment variables")
+    # token id, used to revoke the token on logout
+    to_encode.setdefault("jti", uuid.uuid4().hex)
 
-    algorithm = os.getenv("ALGORITHM")
-
-    encoded_jwt = jwt.encode(to_encode, secret_key, algorithm)
+    key = get_key_ring().active
+    with jwt_duration.time("encode"):
+        encoded_jwt = jwt.encode(to_encode, key.signing_key, key.algorithm, headers={"kid": key.kid})
 
     return encoded_jwt
 
+def user_claims(user: dict) -> dict:
+    # claims of the tokens issued to a user, with the profile when it is embedded
+    claims = {
+            "sub": str(user["_id"]),
+            "email": user["email"]
+            }
+
+    if get_settings().profile_claims:
+        claims["username"] = user["username"]
+        claims["created_at"] = user["created_at"].isoformat()
+        claims["pv"] = user.get("profile_version", 0)
+
+    return claims
+
+@lru_cache(maxsize=1)
+def get_jwks() -> tuple[bytes, str]:
+    # the document only changes with the key ring, so it is serialized and tagged once
+    keys = [key.public_jwk() for key in get_key_ring().keys.values() if key.is_asymmetric]
+
+    body = json.dumps({"keys": keys}, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()}"'
+
+    return body, etag
+
+class TokenVerifier:
+    """
+    holds the key ring resolved once, plus a cache of already verified payloads
+    keyed by the sha256 digest of the token
+    """
+
+    def __init__(self, key_ring: KeyRing, cache_size: int, cache_ttl: float):
+        self.key_ring = key_ring
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def verify(self, token: str) -> dict:
+        digest = hashlib.sha256(token.encode()).digest()
+
+        payload = self.cache.get(digest)
+        if payload is None:
+            with jwt_duration.time("decode"):
+                header = jwt.get_unverified_header(token)
+                key = self.key_ring.get(header.get("kid"), header.get("alg"))
+                payload = jwt.decode(
+                        token,
+                        key.verification_key,
+                        algorithms=[key.algorithm]
+                        )
+
+            # a cached payload must never outlive the token itself
+            exp = payload.get("exp")
+            ttl = None if exp is None else exp - time.time()
+            self.cache.set(digest, payload, ttl)
+
+        # callers get their own copy so the cached payload can't be mutated
+        return dict(payload)
+
+@lru_cache(maxsize=1)
+def get_token_verifier() -> TokenVerifier:
+    try:
+        key_ring = get_key_ring()
+    except ValueError:
+        raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Server configuration error"
+                )
+
+    settings = get_settings()
+    return TokenVerifier(
+            key_ring=key_ring,
+            cache_size=settings.token_cache_size,
+            cache_ttl=settings.token_cache_ttl
+            )
+
+def reset_keys():
+    # drops the key ring, the verifier and the JWKS built from the previous settings
+    get_key_ring.cache_clear()
+    get_token_verifier.cache_clear()
+    get_jwks.cache_clear()
+
 def verify_token(token: str) -> dict:
     
     try:
         if token.startswith("Bearer "):
             token = token[7:]
 
-        secret_key = os.getenv("SECRET_KEY")
-        if not secret_key:
+        verifier = get_token_verifier()
+        payload = verifier.verify(token)
+
+        if revocation_list.is_revoked(payload.get("jti")):
             raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Server configuration error"
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Token revoked"
                     )
 
-        algorithm = os.getenv("ALGORITHM", "HS256")
-        payload = jwt.decode(
-                token,
-                secret_key,
-                algorithms=[algorithm]
-                )
-
         return payload
 
+    except HTTPException:
+        raise
+
     except ExpiredSignatureError:
         raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,79 @@
+"""
+module: warmup.py
+purpose: warm-up of a worker before it reports ready
+"""
+
+from datetime import datetime, timezone
+from fastapi import FastAPI
+from app.config import get_settings
+from app.database import ensure_indexes, ping_database
+from app.models import UserCreate, UserResponse
+from app.utils.password_pool import password_pool
+from app.utils.security import create_access_token, hash_password, verify_password, get_token_verifier
+from app.utils.revocation import revocation_list
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# seconds between attempts when a step fails, doubled up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10
+
+async def open_connections():
+    # concurrent pings force the pool to open min_pool_size connections now
+    # instead of during the first requests
+    connections = max(1, get_settings().mongo_min_pool_size or 1)
+    await asyncio.gather(*(ping_database() for _ in range(connections)))
+
+async def warm_password_pool():
+    # starts the worker threads and pays bcrypt's first call
+    hashed_password = await password_pool.run(hash_password, "warm-up password")
+    await password_pool.run(verify_password, "warm-up password", hashed_password)
+
+async def warm_tokens():
+    token = create_access_token({"sub": "warm-up"})
+    get_token_verifier().verify(token)
+
+async def warm_schemas(app: FastAPI):
+    UserCreate.model_validate({
+        "username": "warm-up",
+        "email": "warm-up@example.com",
+        "password": "warm-up password",
+        "confirm_password": "warm-up password"
+        })
+    UserResponse.model_validate({
+        "id": "000000000000000000000000",
+        "username": "warm-up",
+        "email": "warm-up@example.com",
+        "created_at": datetime.now(timezone.utc)
+        }).model_dump_json()
+    app.openapi()
+
+async def warm_up(app: FastAPI):
+    steps = [
+            ("revoked_tokens", revocation_list.refresh),
+            ("password_pool", warm_password_pool),
+            ("tokens", warm_tokens),
+            ("schemas", lambda: warm_schemas(app))
+            ]
+    if get_settings().uses_mongo:
+        steps[:0] = [("connections", open_connections), ("indexes", ensure_indexes)]
+
+    for name, step in steps:
+        delay = RETRY_DELAY
+        while True:
+            started = time.perf_counter()
+            try:
+                await step()
+                break
+            except Exception:
+                logger.exception("warm-up step %s failed, retrying in %ss", name, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+        app.state.startup["warmup"][name] = round(time.perf_counter() - started, 4)
+
+    app.state.ready = True
+    logger.info("worker ready: %s", app.state.startup)
@@ -0,0 +1,183 @@
+"""
+module: bench_endpoints.py
+purpose: throughput and latency benchmark of the auth and user endpoints, run
+against the in-memory user repository, which keeps every other store in the
+process too, so no mongo is needed
+
+usage:
+    python -m benchmarks.bench_endpoints --concurrency 32 --requests 2000 --output bench.json
+    python -m benchmarks.bench_endpoints --compare bench.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("SECRET_KEY", "benchmark_secret_key")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("USER_REPOSITORY", "memory")
+# the run logs in the same few users from one address, the login throttle would reject it
+os.environ.setdefault("LOGIN_EMAIL_BURST", "0")
+os.environ.setdefault("LOGIN_IP_BURST", "0")
+
+import httpx
+from app.main import app
+
+SCENARIOS = ["register", "login", "get_me", "update_me"]
+PASSWORD = "benchmark_password"
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def git_commit() -> None|str:
+    try:
+        return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True
+                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def register(client: httpx.AsyncClient, email: str) -> httpx.Response:
+    return await client.post("/auth/register", json={
+        "email": email,
+        "username": "benchmark_user",
+        "password": PASSWORD,
+        "confirm_password": PASSWORD
+        })
+
+async def login(client: httpx.AsyncClient, email: str) -> httpx.Response:
+    return await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+
+async def prepare_users(client: httpx.AsyncClient, count: int) -> list:
+    users = []
+    for index in range(count):
+        email = f"seed{index}@bench.example.com"
+        await register(client, email)
+        response = await login(client, email)
+        users.append((email, {"authorization": f"bearer {response.json()['access_token']}"}))
+
+    return users
+
+def make_request(scenario: str, users: list):
+    counter = itertools.count()
+
+    async def request(client: httpx.AsyncClient) -> httpx.Response:
+        number = next(counter)
+        email, headers = users[number % len(users)]
+
+        if scenario == "register":
+            return await register(client, f"user{number}-{time.monotonic_ns()}@bench.example.com")
+        if scenario == "login":
+            return await login(client, email)
+        if scenario == "get_me":
+            return await client.get("/users/me", headers=headers)
+        return await client.put("/users/me", json={"username": f"name{number}"}, headers=headers)
+
+    return request
+
+async def run_scenario(client: httpx.AsyncClient, request, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+            "requests": total,
+            "errors": errors,
+            "seconds": round(elapsed, 4),
+            "requests_per_second": round(total / elapsed, 2),
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies) * 1000, 3),
+                "p50": round(percentile(latencies, 0.50) * 1000, 3),
+                "p95": round(percentile(latencies, 0.95) * 1000, 3),
+                "p99": round(percentile(latencies, 0.99) * 1000, 3)
+                }
+            }
+
+async def run(args) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        users = await prepare_users(client, args.users)
+
+        results = {}
+        for scenario in args.scenarios:
+            # hashing bound scenarios are far slower, they get their own request count
+            total = args.hash_requests if scenario in ("register", "login") else args.requests
+            results[scenario] = await run_scenario(client, make_request(scenario, users), total, args.concurrency)
+            print(f"{scenario:<10} {results[scenario]['requests_per_second']:>10} req/s  "
+                  f"p50 {results[scenario]['latency_ms']['p50']:>8} ms  "
+                  f"p95 {results[scenario]['latency_ms']['p95']:>8} ms  "
+                  f"p99 {results[scenario]['latency_ms']['p99']:>8} ms  "
+                  f"errors {results[scenario]['errors']}")
+
+    return {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "results": results
+            }
+
+def compare(report: dict, baseline: dict):
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for scenario, result in report["results"].items():
+        previous = baseline.get("results", {}).get(scenario)
+        if not previous:
+            continue
+
+        throughput = (result["requests_per_second"] / previous["requests_per_second"] - 1) * 100
+        p99 = (result["latency_ms"]["p99"] / previous["latency_ms"]["p99"] - 1) * 100 if previous["latency_ms"]["p99"] else 0.0
+        print(f"{scenario:<10} throughput {throughput:+7.1f}%  p99 {p99:+7.1f}%")
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="benchmark the auth and user endpoints")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at the same time")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--hash-requests", type=int, default=200, help="requests for register and login, which hash passwords")
+    parser.add_argument("--users", type=int, default=20, help="users created before the run")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+
+    return parser.parse_args(argv)
+
+def main(argv: list):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(report, json.load(baseline_file))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""
+module: bench_serialization.py
+purpose: micro-benchmark of the per-request cost of building and serializing a
+UserResponse, fastapi's response_model path against the direct response path
+
+usage:
+    python -m benchmarks.bench_serialization --iterations 20000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from app.main import app
+from app.models import UserResponse
+from app.utils.responses import user_response
+
+USER = {
+        "_id": ObjectId("507f1f77bcf86cd799439011"),
+        "username": "benchmark_user",
+        "email": "benchmark@example.com",
+        "created_at": datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        }
+
+def response_field(path: str, method: str):
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route.secure_cloned_response_field
+
+    raise LookupError(f"{method} {path} is not a route")
+
+async def response_model_path(field) -> bytes:
+    # what the handlers did before: validate a model by hand, then fastapi
+    # validates it again against response_model, encodes it and json.dumps it
+    model = UserResponse(
+            id=str(USER["_id"]),
+            username=USER["username"],
+            email=USER["email"],
+            created_at=USER["created_at"]
+            )
+    content = await serialize_response(field=field, response_content=model)
+
+    return JSONResponse(content).body
+
+async def direct_path(field) -> bytes:
+    return user_response(USER).body
+
+async def measure(path, field, iterations: int) -> float:
+    # microseconds per response, best of three rounds
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await path(field)
+        timings.append((time.perf_counter() - started) / iterations * 1_000_000)
+
+    return min(timings)
+
+async def run(iterations: int):
+    field = response_field("/users/me", "GET")
+
+    before = await response_model_path(field)
+    after = await direct_path(field)
+    assert UserResponse.model_validate_json(before) == UserResponse.model_validate_json(after)
+
+    slow = await measure(response_model_path, field, iterations)
+    fast = await measure(direct_path, field, iterations)
+    print(f"response_model path {slow:>8.2f} us per response")
+    print(f"direct path         {fast:>8.2f} us per response")
+    print(f"saved               {slow - fast:>8.2f} us ({(1 - fast / slow) * 100:.0f}%)")
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="benchmark the serialization of a UserResponse")
+    parser.add_argument("--iterations", type=int, default=20000, help="responses per round")
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args.iterations))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
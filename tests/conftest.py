@@ -6,6 +6,54 @@ import pytest
 from app.main import app
 from fastapi.testclient import TestClient
 from datetime import datetime, timezone
+from app.utils.dependencies import user_cache
+from app.config import Settings, get_settings, set_settings
+from app.utils.security import reset_keys
+from app.utils.rate_limit import login_throttle
+from app.utils.idempotency import idempotency_store
+from app.utils.login_audit import login_audit
+
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    user_cache.clear()
+    yield
+    user_cache.clear()
+
+@pytest.fixture(autouse=True)
+def clear_login_throttle():
+    login_throttle.clear()
+    yield
+    login_throttle.clear()
+
+@pytest.fixture(autouse=True)
+def clear_login_audit():
+    login_audit.clear()
+    yield
+    login_audit.clear()
+
+@pytest.fixture(autouse=True)
+def clear_idempotency_store():
+    idempotency_store.clear()
+    yield
+    idempotency_store.clear()
+
+@pytest.fixture
+def use_settings():
+    previous = get_settings()
+
+    def apply(**overrides) -> Settings:
+        settings = Settings(**overrides)
+        set_settings(settings)
+        reset_keys()
+        return settings
+
+    yield apply
+    set_settings(previous)
+    reset_keys()
+
+@pytest.fixture
+def token_settings(use_settings):
+    return use_settings(secret_key="test_secret_key", algorithm="HS256")
 
 @pytest.fixture
 def client():
@@ -42,7 +90,7 @@ def mock_verify_token(mocker, mock_payload):
 
 @pytest.fixture
 def mock_token(mocker, mock_user, client):
-    mock_get_collection = mocker.MagicMock()
+    mock_get_collection = mocker.AsyncMock()
     mock_get_collection.find_one.return_value = mock_user
 
     mock_verify_password = mocker.MagicMock(return_value=True)
@@ -51,7 +99,7 @@ def mock_token(mocker, mock_user, client):
     mock_token = "falsetoken"
     mock_create_access_token.return_value = mock_token
 
-    mocker.patch("app.routes.auth.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mocker.patch("app.routes.auth.verify_password", mock_verify_password)
     mocker.patch("app.routes.auth.create_access_token", mock_create_access_token)
     
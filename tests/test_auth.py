@@ -6,18 +6,18 @@ import pytest
 from app.main import app
 from fastapi.testclient import TestClient
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone
+from app.utils.security import hash_password, hash_cost, verify_password
 
 client = TestClient(app)
 
 def test_successful_registration(mocker):
 
-    mock_get_collection = mocker.patch("app.routes.auth.get_collection")
-    mock_collection = mocker.MagicMock()
+    mock_get_collection = mocker.patch("app.repository.get_collection")
+    mock_collection = mocker.AsyncMock()
     mock_get_collection.return_value = mock_collection
 
-    mock_collection.find_one.return_value = None
-
     test_id = ObjectId("507f1f77bcf86cd799439011")
     mock_object_id = mocker.patch("app.routes.auth.ObjectId")
     mock_object_id.return_value = test_id
@@ -45,17 +45,21 @@ def test_successful_registration(mocker):
     assert data["email"] == "testemail@example.com"
     assert data["username"] == "test_user"
 
-    mock_collection.find_one.assert_called_once_with({"email":"testemail@example.com"})
+    mock_collection.find_one.assert_not_called()
+    mock_collection.insert_one.assert_called_once()
+    inserted = mock_collection.insert_one.call_args.args[0]
+    assert inserted["_id"] == test_id
+    assert inserted["email"] == "testemail@example.com"
+    assert inserted["hashed_password"] == "hashed_password_123"
     mock_hash.assert_called_once_with("12345")
 
 def test_if_user_already_exists(mocker):
 
-    mock_get_collection = mocker.MagicMock()
-    mock_find_one = mocker.MagicMock(return_value={"_id":"existing_id","email":"testemail@example.com"})
-
-    mock_get_collection.find_one = mock_find_one
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
 
-    mocker.patch("app.routes.auth.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.routes.auth.hash_password", return_value="hashed_password_123")
 
     user_data = {
         "email":"testemail@example.com",
@@ -69,12 +73,13 @@ def test_if_user_already_exists(mocker):
     assert response.status_code == 409
     assert response.json()["detail"] == "User already exist"
 
-    assert not mock_get_collection.insert_one.called
+    mock_get_collection.find_one.assert_not_called()
+    mock_get_collection.insert_one.assert_called_once()
 
 # Login tests
 def test_login_success(mocker):
     
-    mock_get_collection = mocker.MagicMock()
+    mock_get_collection = mocker.AsyncMock()
     mock_user = {
         "_id": "user123",
         "email": "test@example.com",
@@ -88,7 +93,7 @@ def test_login_success(mocker):
     mock_token = "falsetoken"
     mock_create_access_token.return_value = mock_token
 
-    mocker.patch("app.routes.auth.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mocker.patch("app.routes.auth.verify_password", mock_verify_password)
     mocker.patch("app.routes.auth.create_access_token", mock_create_access_token)
     
@@ -109,10 +114,10 @@ def test_login_success(mocker):
 
 def test_login_user_not_found(mocker):
     
-    mock_get_collection = mocker.MagicMock()
+    mock_get_collection = mocker.AsyncMock()
     mock_get_collection.find_one.return_value = None
 
-    mocker.patch("app.routes.auth.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
 
     login_data = {
         "email": "nonexistent@example.com",
@@ -128,7 +133,7 @@ def test_login_user_not_found(mocker):
 
 def test_login_with_wrong_password(mocker):
 
-    mock_get_collection = mocker.MagicMock()
+    mock_get_collection = mocker.AsyncMock()
     user_data = {
         "_id": "user123", 
         "email": "test@example.com",
@@ -139,7 +144,7 @@ def test_login_with_wrong_password(mocker):
 
     mock_verify_password = mocker.MagicMock(return_value=False)
 
-    mocker.patch("app.routes.auth.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mocker.patch("app.routes.auth.verify_password", mock_verify_password)
 
     login_data = {
@@ -153,3 +158,48 @@ def test_login_with_wrong_password(mocker):
     assert response.json()["detail"] == "Incorrect Credentials"
 
     mock_verify_password.assert_called_once_with("wrongpassword", "hashed_password_123")
+
+def test_login_rehashes_outdated_cost(mocker, use_settings):
+    use_settings(secret_key="test_secret_key", bcrypt_rounds=5)
+
+    old_hash = hash_password("correctpassword123", rounds=4)
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = {
+        "_id": "user123",
+        "email": "test@example.com",
+        "hashed_password": old_hash
+    }
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.post("/auth/login", json={
+        "email": "test@example.com",
+        "password": "correctpassword123"
+        })
+
+    assert response.status_code == 200
+
+    mock_get_collection.update_one.assert_awaited_once()
+    update_filter, update = mock_get_collection.update_one.call_args.args
+    assert update_filter == {"_id": "user123", "hashed_password": old_hash}
+    new_hash = update["$set"]["hashed_password"]
+    assert hash_cost(new_hash) == 5
+    assert verify_password("correctpassword123", new_hash)
+
+def test_login_keeps_current_cost(mocker, use_settings):
+    use_settings(secret_key="test_secret_key", bcrypt_rounds=4)
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = {
+        "_id": "user123",
+        "email": "test@example.com",
+        "hashed_password": hash_password("correctpassword123")
+    }
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.post("/auth/login", json={
+        "email": "test@example.com",
+        "password": "correctpassword123"
+        })
+
+    assert response.status_code == 200
+    mock_get_collection.update_one.assert_not_called()
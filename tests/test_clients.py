@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from app.utils.clients import client_secret_digest
+from app.utils.security import verify_token
+
+CLIENT_SECRET_KEY = "test_client_secret_key"
+SECRET = "billing-secret"
+
+@pytest.fixture
+def client_settings(use_settings):
+    digest = client_secret_digest(SECRET, CLIENT_SECRET_KEY)
+    return use_settings(
+            secret_key="test_secret_key",
+            client_secret_key=CLIENT_SECRET_KEY,
+            service_clients=f"billing={digest}:users:read users:lookup, reports={digest}:"
+            )
+
+def test_client_credentials_with_basic_auth(client, client_settings):
+    response = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("billing", SECRET))
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["token_type"] == "bearer"
+    assert body["scope"] == "users:lookup users:read"
+    assert body["expires_in"] == 30 * 60
+    assert response.headers["Cache-Control"] == "no-store"
+
+    payload = verify_token(body["access_token"])
+    assert payload["sub"] == payload["client_id"] == "billing"
+    assert payload["scope"] == "users:lookup users:read"
+
+def test_cached_token_reused_per_scope(client, client_settings, mocker):
+    spy = mocker.spy(sys.modules["app.utils.clients"], "create_access_token")
+
+    first = client.post("/auth/token", json={"grant_type": "client_credentials", "client_id": "billing", "client_secret": SECRET})
+    second = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("billing", SECRET))
+    narrowed = client.post("/auth/token", data={"grant_type": "client_credentials", "scope": "users:read"}, auth=("billing", SECRET))
+
+    assert first.json()["access_token"] == second.json()["access_token"]
+    assert narrowed.json()["scope"] == "users:read"
+    assert narrowed.json()["access_token"] != first.json()["access_token"]
+    assert spy.call_count == 2
+
+def test_token_refreshed_near_expiry(client, client_settings, use_settings):
+    use_settings(**{**client_settings.model_dump(), "client_token_refresh_margin": 30 * 60})
+
+    first = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("billing", SECRET))
+    second = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("billing", SECRET))
+
+    assert first.json()["access_token"] != second.json()["access_token"]
+
+def test_client_credentials_rejected(client, client_settings):
+    wrong_secret = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("billing", "wrong"))
+    unknown_client = client.post("/auth/token", data={"grant_type": "client_credentials"}, auth=("unknown", SECRET))
+    wrong_scope = client.post("/auth/token", data={"grant_type": "client_credentials", "scope": "users:write"}, auth=("billing", SECRET))
+    wrong_grant = client.post("/auth/token", data={"grant_type": "password"}, auth=("billing", SECRET))
+
+    assert wrong_secret.status_code == unknown_client.status_code == 401
+    assert wrong_secret.json()["detail"] == "invalid_client"
+    assert wrong_scope.status_code == 400
+    assert wrong_scope.json()["detail"] == "invalid_scope"
+    assert wrong_grant.json()["detail"] == "unsupported_grant_type"
+
+def client_token(client, scope: str) -> str:
+    response = client.post("/auth/token", data={"grant_type": "client_credentials", "scope": scope}, auth=("billing", SECRET))
+    return response.json()["access_token"]
+
+def test_lookup_requires_its_scope(client, client_settings, mocker):
+    mock_get_collection = mocker.MagicMock()
+    mock_get_collection.find.return_value.to_list = mocker.AsyncMock(return_value=[])
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+    body = {"emails": ["b@example.com"]}
+
+    read_only = client.post("/users/lookup", json=body, headers={"authorization": f"bearer {client_token(client, 'users:read')}"})
+    lookup = client.post("/users/lookup", json=body, headers={"authorization": f"bearer {client_token(client, 'users:lookup')}"})
+
+    assert read_only.status_code == 403
+    assert read_only.json()["detail"] == "Scope users:lookup required"
+    assert 'error="insufficient_scope"' in read_only.headers["WWW-Authenticate"]
+    assert lookup.status_code == 200
+    assert lookup.json() == {"results": [{"key": "b@example.com", "user": None}]}
+
+def test_client_token_refused_by_user_endpoints(client, client_settings, mocker):
+    mock_get_collection = mocker.patch("app.repository.get_collection")
+    headers = {"authorization": f"bearer {client_token(client, 'users:lookup users:read')}"}
+
+    assert client.get("/users/me", headers=headers).status_code == 403
+    assert client.put("/users/me", json={"username": "billing"}, headers=headers).status_code == 403
+    assert client.delete("/users/me", headers=headers).status_code == 403
+    assert client.get("/users", headers=headers).status_code == 403
+    mock_get_collection.assert_not_called()
@@ -0,0 +1,175 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+import threading
+import httpx
+from app.main import app
+from app.repository import MemoryUserRepository, get_user_repository, set_user_repository
+from pymongo.errors import DuplicateKeyError
+from app.utils.idempotency import IdempotencyStore, idempotency_store
+from app.utils.responses import FastJSONResponse
+
+REGISTRATION = {
+    "email":"test@example.com",
+    "username":"test_user",
+    "password":"12345",
+    "confirm_password":"12345"
+    }
+
+@pytest.fixture
+def memory_repository():
+    previous = get_user_repository()
+    repository = MemoryUserRepository()
+    set_user_repository(repository)
+    yield repository
+    set_user_repository(previous)
+
+def test_replay_returns_first_response(client, mocker, memory_repository):
+    mock_hash = mocker.patch("app.routes.auth.hash_password", return_value="hashed_password_123")
+    headers = {"Idempotency-Key": "registration-1"}
+
+    first = client.post("/auth/register", json=REGISTRATION, headers=headers)
+    retry = client.post("/auth/register", json=REGISTRATION, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["ETag"] == first.headers["ETag"]
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    mock_hash.assert_called_once()
+    assert len(memory_repository) == 1
+
+def test_conflict_is_replayed(client, mocker, memory_repository):
+    mock_hash = mocker.patch("app.routes.auth.hash_password", return_value="hashed_password_123")
+    client.post("/auth/register", json=REGISTRATION)
+
+    first = client.post("/auth/register", json=REGISTRATION, headers={"Idempotency-Key": "registration-2"})
+    retry = client.post("/auth/register", json=REGISTRATION, headers={"Idempotency-Key": "registration-2"})
+
+    assert first.status_code == retry.status_code == 409
+    assert retry.json() == {"detail": "User already exist"}
+    assert mock_hash.call_count == 2
+
+def test_key_reused_with_another_request(client, mocker, memory_repository):
+    mocker.patch("app.routes.auth.hash_password", return_value="hashed_password_123")
+    headers = {"Idempotency-Key": "registration-3"}
+
+    client.post("/auth/register", json=REGISTRATION, headers=headers)
+    response = client.post("/auth/register", json={**REGISTRATION, "email": "other@example.com"}, headers=headers)
+
+    assert response.status_code == 422
+    assert len(memory_repository) == 1
+
+def test_concurrent_duplicates_wait_for_the_first(mocker, memory_repository, token_settings):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_hash(password):
+        started.set()
+        release.wait(5)
+        return "hashed_password_123"
+
+    mock_hash = mocker.patch("app.routes.auth.hash_password", side_effect=slow_hash)
+
+    async def register_twice():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"Idempotency-Key": "registration-4"}
+            first = asyncio.create_task(client.post("/auth/register", json=REGISTRATION, headers=headers))
+            await asyncio.to_thread(started.wait, 5)
+            second = asyncio.create_task(client.post("/auth/register", json=REGISTRATION, headers=headers))
+            await asyncio.sleep(0.05)
+            assert idempotency_store.stats()["in_flight"] == 1
+            release.set()
+            return await first, await second
+
+    first, second = asyncio.run(register_twice())
+
+    assert first.status_code == second.status_code == 201
+    assert second.json() == first.json()
+    mock_hash.assert_called_once()
+
+class SharedCollection:
+    # the idempotency_keys collection, seen by several stores standing in for workers
+    def __init__(self):
+        self.documents = {}
+
+    @staticmethod
+    def matches(document, query) -> bool:
+        return all(document.get(field) == value for field, value in query.items())
+
+    async def insert_one(self, document):
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError("duplicate key")
+        self.documents[document["_id"]] = dict(document)
+
+    async def find_one(self, query):
+        document = self.documents.get(query["_id"])
+        return dict(document) if document is not None else None
+
+    async def replace_one(self, query, replacement):
+        document = self.documents.get(query["_id"])
+        if document is None or not self.matches(document, query):
+            return mock_result(matched_count=0)
+        self.documents[query["_id"]] = {"_id": query["_id"], **replacement}
+        return mock_result(matched_count=1)
+
+    async def delete_one(self, query):
+        document = self.documents.get(query["_id"])
+        if document is not None and self.matches(document, query):
+            del self.documents[query["_id"]]
+
+def mock_result(**fields):
+    return type("Result", (), fields)()
+
+def test_duplicate_on_another_worker_waits_for_the_first(mocker):
+    collection = SharedCollection()
+    mocker.patch("app.utils.idempotency.get_collection", return_value=collection)
+    worker_a = IdempotencyStore(maxsize=10, ttl=60, mongo=True)
+    worker_b = IdempotencyStore(maxsize=10, ttl=60, mongo=True)
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def create_user():
+            calls.append(1)
+            await release.wait()
+            return FastJSONResponse({"id": "created"}, status_code=201)
+
+        first = asyncio.create_task(worker_a.run("registration-5", "fingerprint", create_user))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(worker_b.run("registration-5", "fingerprint", create_user))
+        await asyncio.sleep(0.1)
+        assert collection.documents["registration-5"]["state"] == "pending"
+        release.set()
+        return await first, await second
+
+    first, second = asyncio.run(scenario())
+
+    assert first.status_code == second.status_code == 201
+    assert second.body == first.body
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert len(calls) == 1
+    assert collection.documents["registration-5"]["state"] == "done"
+
+def test_failed_request_releases_the_key_for_other_workers(mocker):
+    collection = SharedCollection()
+    mocker.patch("app.utils.idempotency.get_collection", return_value=collection)
+    worker_a = IdempotencyStore(maxsize=10, ttl=60, mongo=True)
+    worker_b = IdempotencyStore(maxsize=10, ttl=60, mongo=True)
+
+    async def unavailable():
+        return FastJSONResponse({"detail": "unavailable"}, status_code=503)
+
+    async def created():
+        return FastJSONResponse({"id": "created"}, status_code=201)
+
+    failed = asyncio.run(worker_a.run("registration-6", "fingerprint", unavailable))
+    retried = asyncio.run(worker_b.run("registration-6", "fingerprint", created))
+
+    assert failed.status_code == 503
+    assert retried.status_code == 201
+    assert "Idempotent-Replayed" not in retried.headers
@@ -0,0 +1,115 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from datetime import datetime, timezone
+from bson import ObjectId
+from app.repository import MemoryUserRepository, get_user_repository, set_user_repository
+from app.utils.login_audit import LoginAudit, login_audit
+
+@pytest.fixture
+def memory_repository():
+    previous = get_user_repository()
+    repository = MemoryUserRepository()
+    set_user_repository(repository)
+    yield repository
+    set_user_repository(previous)
+
+@pytest.fixture
+def events_collection(mocker):
+    collection = mocker.AsyncMock()
+    mocker.patch("app.utils.login_audit.get_collection", return_value=collection)
+    return collection
+
+def test_flush_writes_batches_and_coalesces_last_logins(events_collection, memory_repository):
+    user_id = ObjectId()
+    asyncio.run(memory_repository.create({
+        "_id": user_id,
+        "username": "test_user",
+        "email": "test@example.com",
+        "hashed_password": "hashed_password_123",
+        "created_at": datetime(2025,1,1,12,0,0,tzinfo=timezone.utc)
+        }))
+    audit = LoginAudit(batch_size=2, flush_interval=1, queue_size=10)
+
+    audit.record(user_id, "test@example.com", True, "1.2.3.4")
+    audit.record(user_id, "test@example.com", False, "1.2.3.4")
+    audit.record(user_id, "test@example.com", True, "1.2.3.4")
+    asyncio.run(audit.flush())
+
+    assert events_collection.insert_many.call_count == 2
+    assert [len(call.args[0]) for call in events_collection.insert_many.call_args_list] == [2, 1]
+    last_login_at = asyncio.run(memory_repository.find_by_email("test@example.com"))["last_login_at"]
+    assert last_login_at == events_collection.insert_many.call_args_list[1].args[0][0]["at"]
+    assert audit.stats() == {"queued": 0, "queue_size": 10, "written": 3, "dropped": 0, "failed": 0, "batches": 2}
+
+def test_memory_mode_writes_last_login_only(events_collection, memory_repository):
+    user_id = ObjectId()
+    asyncio.run(memory_repository.create({
+        "_id": user_id,
+        "username": "test_user",
+        "email": "test@example.com",
+        "hashed_password": "hashed_password_123",
+        "created_at": datetime(2025,1,1,12,0,0,tzinfo=timezone.utc)
+        }))
+    audit = LoginAudit(batch_size=2, flush_interval=1, queue_size=10, memory=True)
+
+    audit.record(user_id, "test@example.com", True, "1.2.3.4")
+    asyncio.run(audit.flush())
+
+    events_collection.insert_many.assert_not_called()
+    assert asyncio.run(memory_repository.find_by_email("test@example.com"))["last_login_at"] is not None
+    assert audit.stats()["written"] == 1
+
+def test_full_queue_drops_new_events(events_collection):
+    audit = LoginAudit(batch_size=10, flush_interval=1, queue_size=2)
+
+    for _ in range(5):
+        audit.record(None, "test@example.com", False, None)
+
+    assert audit.stats()["queued"] == 2
+    assert audit.stats()["dropped"] == 3
+
+def test_worker_flushes_on_size_and_drains_on_stop(events_collection):
+    audit = LoginAudit(batch_size=2, flush_interval=60, queue_size=10)
+
+    async def scenario():
+        worker = asyncio.create_task(audit.run())
+        await asyncio.sleep(0)
+
+        # a full batch wakes the worker well before the interval
+        audit.record(None, "a@example.com", False, None)
+        audit.record(None, "b@example.com", False, None)
+        await asyncio.sleep(0.05)
+        written = audit.stats()["written"]
+
+        audit.record(None, "c@example.com", False, None)
+        audit.stop()
+        await asyncio.wait_for(worker, timeout=1)
+        return written
+
+    assert asyncio.run(scenario()) == 2
+    assert audit.stats()["written"] == 3
+    assert audit.stats()["queued"] == 0
+
+def test_login_records_events(client, mocker):
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = {
+        "_id": "user123",
+        "email": "test@example.com",
+        "hashed_password": "hashed_password_123"
+        }
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+    mocker.patch("app.routes.auth.verify_password", side_effect=[True, False])
+    mocker.patch("app.routes.auth.create_access_token", return_value="falsetoken")
+
+    assert client.post("/auth/login", json={"email":"Test@example.com", "password":"12345"}).status_code == 200
+    assert client.post("/auth/login", json={"email":"test@example.com", "password":"wrong"}).status_code == 401
+
+    events = list(login_audit._events)
+    assert [(event["user_id"], event["email"], event["success"]) for event in events] == [
+            ("user123", "test@example.com", True),
+            ("user123", "test@example.com", False)
+            ]
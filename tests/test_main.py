@@ -0,0 +1,151 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import time
+from app.main import app, create_app
+from fastapi.testclient import TestClient
+from app.config import Settings, get_settings
+from app.database import pool_options
+from app.utils.password_pool import password_pool
+from app.utils.security import create_access_token
+
+@pytest.fixture
+def ready_app():
+    app.state.ready = True
+    yield app
+    app.state.ready = False
+
+@pytest.fixture
+def mock_warm_up(mocker):
+    mocks = {
+            "ensure_indexes": mocker.patch("app.utils.warmup.ensure_indexes", new_callable=mocker.AsyncMock),
+            "ping_database": mocker.patch("app.utils.warmup.ping_database", new_callable=mocker.AsyncMock),
+            "refresh": mocker.patch("app.utils.warmup.revocation_list.refresh", new_callable=mocker.AsyncMock),
+            "hash_password": mocker.patch("app.utils.warmup.hash_password", return_value="hashed_password_123"),
+            "verify_password": mocker.patch("app.utils.warmup.verify_password", return_value=True)
+            }
+    mocker.patch("app.routes.operations.ping_database", new_callable=mocker.AsyncMock)
+    return mocks
+
+def wait_until_ready(client, timeout: float = 5) -> list:
+    statuses = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        statuses.append(client.get("/").status_code)
+        if statuses[-1] == 200:
+            break
+        time.sleep(0.01)
+
+    return statuses
+
+def test_startup_warms_up_before_ready(mocker, token_settings, mock_warm_up):
+    mock_connect = mocker.patch("app.main.connect_database")
+    mock_close = mocker.patch("app.main.close_database", new_callable=mocker.AsyncMock)
+
+    with TestClient(app) as client:
+        statuses = wait_until_ready(client)
+
+    assert statuses[-1] == 200
+    assert all(status in (200, 503) for status in statuses)
+    mock_warm_up["ensure_indexes"].assert_awaited_once()
+    mock_warm_up["refresh"].assert_awaited_once()
+    mock_warm_up["ping_database"].assert_awaited()
+    mock_warm_up["hash_password"].assert_called_once()
+    mock_connect.assert_called_once()
+    mock_close.assert_awaited_once()
+    assert set(app.state.startup["warmup"]) == {"connections", "indexes", "revoked_tokens", "password_pool", "tokens", "schemas"}
+    app.state.ready = False
+
+def test_warm_up_retries_failed_step(mocker, token_settings, mock_warm_up):
+    mocker.patch("app.utils.warmup.RETRY_DELAY", 0.01)
+    mock_warm_up["ensure_indexes"].side_effect = [Exception("server selection timeout"), None]
+    mocker.patch("app.main.connect_database")
+    mocker.patch("app.main.close_database", new_callable=mocker.AsyncMock)
+
+    with TestClient(app) as client:
+        statuses = wait_until_ready(client)
+
+    assert statuses[-1] == 200
+    assert mock_warm_up["ensure_indexes"].await_count == 2
+    app.state.ready = False
+
+def test_not_ready_before_warm_up(client):
+
+    response = client.get("/")
+
+    assert response.status_code == 503
+    assert response.json() == {"status":"WARMING_UP"}
+
+def test_readiness_ok(client, mocker, ready_app):
+    mock_ping = mocker.patch("app.routes.operations.ping_database", new_callable=mocker.AsyncMock)
+
+    response = client.get("/")
+
+    assert response.status_code == 200
+    assert response.json() == {"status":"OK"}
+    mock_ping.assert_awaited_once()
+
+def test_readiness_database_unreachable(client, mocker, ready_app):
+    mocker.patch("app.routes.operations.ping_database", new_callable=mocker.AsyncMock, side_effect=Exception("timeout"))
+
+    response = client.get("/")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "UNAVAILABLE"
+
+def test_pool_options_from_settings():
+    settings = Settings(mongo_max_pool_size=50, mongo_wait_queue_timeout_ms=2000)
+
+    options = pool_options(settings)
+
+    assert options["maxPoolSize"] == 50
+    assert options["waitQueueTimeoutMS"] == 2000
+    assert "minPoolSize" not in options
+
+def test_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "50")
+    monkeypatch.setenv("ACCESS_TOKEN_EXPIRE_TIME", "15")
+    monkeypatch.setenv("RETIRED_KEYS", "")
+
+    settings = Settings.from_env()
+
+    assert settings.mongo_max_pool_size == 50
+    assert settings.access_token_expire_time == 15
+    assert settings.retired_keys == ""
+
+def test_create_app_applies_settings():
+    previous = get_settings()
+
+    factory_app = create_app(Settings(secret_key="factory_secret", password_hash_workers=2, password_hash_queue_size=8))
+
+    assert get_settings().secret_key == "factory_secret"
+    assert password_pool.workers == 2
+    assert password_pool.queue_size == 8
+    assert factory_app.state.startup["factory_seconds"] >= 0
+
+    create_app(previous)
+
+def test_memory_mode_never_reaches_mongo(mocker, mock_warm_up):
+    previous = get_settings()
+    mock_connect = mocker.patch("app.main.connect_database")
+    mock_get_collection = mocker.patch("app.utils.revocation.get_collection")
+    memory_app = create_app(Settings(secret_key="test_secret_key", user_repository="memory"))
+    token = create_access_token({"sub": "507f1f77bcf86cd799439011"})
+
+    try:
+        with TestClient(memory_app) as client:
+            statuses = wait_until_ready(client)
+            logout = client.post("/auth/logout", headers={"authorization":f"bearer {token}"})
+            after_logout = client.post("/auth/logout", headers={"authorization":f"bearer {token}"})
+    finally:
+        create_app(previous)
+
+    assert statuses[-1] == 200
+    assert logout.status_code == 204
+    assert after_logout.status_code == 401
+    assert set(memory_app.state.startup["warmup"]) == {"revoked_tokens", "password_pool", "tokens", "schemas"}
+    mock_warm_up["ensure_indexes"].assert_not_awaited()
+    mock_connect.assert_not_called()
+    mock_get_collection.assert_not_called()
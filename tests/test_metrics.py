@@ -0,0 +1,38 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from app.utils.metrics import Histogram, Gauge
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_duration_seconds", "test histogram", ("operation",), buckets=(0.1, 1.0))
+
+    histogram.observe(0.05, "hash")
+    histogram.observe(0.5, "hash")
+    histogram.observe(5, "hash")
+
+    lines = histogram.render()
+
+    assert 'test_duration_seconds_bucket{operation="hash",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{operation="hash",le="1"} 2' in lines
+    assert 'test_duration_seconds_bucket{operation="hash",le="+Inf"} 3' in lines
+    assert 'test_duration_seconds_count{operation="hash"} 3' in lines
+    assert 'test_duration_seconds_sum{operation="hash"} 5.55' in lines
+
+def test_gauge_reads_function():
+    gauge = Gauge("test_entries", "test gauge", ("cache",), function=lambda: {("user",): 3})
+
+    assert 'test_entries{cache="user"} 3' in gauge.render()
+
+def test_metrics_endpoint_records_route_template(client, token_settings):
+    client.get("/users/me")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/users/me",status="403"}' in response.text
+    assert "http_requests_in_flight 0" in response.text
+    assert 'cache_hits_total{cache="user"}' in response.text
+    assert "/metrics" not in response.text
@@ -0,0 +1,48 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+import threading
+from fastapi import HTTPException
+from app.utils.password_pool import PasswordPool
+
+def test_pool_runs_job_and_reports_stats():
+    pool = PasswordPool(workers=2, queue_size=2)
+
+    result = asyncio.run(pool.run(lambda a, b: a + b, 1, 2))
+
+    assert result == 3
+    stats = pool.stats()
+    assert stats["completed"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["rejected"] == 0
+    pool.shutdown()
+
+def test_pool_rejects_when_queue_is_full():
+    pool = PasswordPool(workers=1, queue_size=1, retry_after=3)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+
+        assert pool.stats()["queue_depth"] == 1
+
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(release.wait)
+
+        release.set()
+        await asyncio.gather(running, queued)
+        return exc_info.value
+
+    error = asyncio.run(scenario())
+
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "3"
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["completed"] == 2
+    pool.shutdown()
@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from pydantic import ValidationError
+from app.config import Settings
+from fastapi import HTTPException
+from app.utils.rate_limit import LoginThrottle, MemoryBucketStore, login_throttle
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def take(store, key, capacity=3, per_second=1.0) -> float:
+    return asyncio.run(store.take(key, capacity, per_second))
+
+def test_bucket_allows_burst_then_rejects():
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+
+    assert [take(store, "email:a") for _ in range(3)] == [0, 0, 0]
+    assert take(store, "email:a") == pytest.approx(1.0)
+
+    clock.now += 1
+    assert take(store, "email:a") == 0
+    assert take(store, "email:b") == 0
+
+def test_full_buckets_expire_and_memory_is_bounded():
+    clock = FakeClock()
+    store = MemoryBucketStore(max_buckets=4, shards=1, clock=clock)
+
+    for index in range(10):
+        take(store, f"ip:{index}")
+    assert store.stats()["buckets"] == 4
+    assert store.stats()["evictions"] == 6
+
+    # one second refills the single token each bucket spent
+    clock.now += 1
+    take(store, "ip:new")
+    assert store.stats()["buckets"] == 1
+
+def test_zero_refill_rate_is_rejected():
+    with pytest.raises(ValidationError):
+        Settings(login_email_per_minute=0)
+    with pytest.raises(ValidationError):
+        Settings(login_ip_per_minute=0)
+
+    # a burst of 0 is how a limit is disabled
+    assert Settings(login_ip_burst=0).login_ip_burst == 0
+
+def test_login_throttled_before_lookup(mocker, client):
+    mock_get_collection = mocker.patch("app.repository.get_collection", return_value=mocker.AsyncMock(**{"find_one.return_value": None}))
+    mock_verify_password = mocker.patch("app.routes.auth.verify_password")
+    mocker.patch.object(login_throttle, "email_capacity", 1)
+
+    login_data = {"email": "Test@example.com", "password": "wrongpassword"}
+    client.post("/auth/login", json=login_data)
+    mock_get_collection.reset_mock()
+
+    response = client.post("/auth/login", json=login_data)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    mock_get_collection.assert_not_called()
+    mock_verify_password.assert_not_called()
+    assert login_throttle.stats()["rejected_email"] == 1
+
+def test_login_throttled_per_client_ip(mocker, client):
+    mocker.patch("app.repository.get_collection", return_value=mocker.AsyncMock(**{"find_one.return_value": None}))
+    mocker.patch.object(login_throttle, "ip_capacity", 2)
+
+    statuses = [
+            client.post("/auth/login", json={"email": f"user{index}@example.com", "password": "password"}).status_code
+            for index in range(3)
+            ]
+
+    assert statuses == [401, 401, 429]
+    assert login_throttle.stats()["rejected_ip"] == 1
+
+def test_ip_rejected_attempts_leave_email_bucket_untouched():
+    throttle = LoginThrottle(MemoryBucketStore(), email_capacity=2, email_per_minute=1, ip_capacity=1, ip_per_minute=1)
+
+    asyncio.run(throttle.check("victim@example.com", "1.1.1.1"))
+    for _ in range(5):
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(throttle.check("victim@example.com", "1.1.1.1"))
+        assert exc_info.value.status_code == 429
+
+    # the victim still has the token the throttled address did not get to spend
+    asyncio.run(throttle.check("victim@example.com", "2.2.2.2"))
+    assert throttle.stats()["rejected_ip"] == 5
+    assert throttle.stats()["rejected_email"] == 0
@@ -0,0 +1,143 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from bson import ObjectId
+from app.utils.security import create_access_token
+from app.repository import UserRepository, MemoryUserRepository, DuplicateUserError, get_user_repository, set_user_repository
+
+def new_user(email: str, **fields) -> dict:
+    return {
+        "_id": ObjectId(),
+        "username": "test_user",
+        "email": email,
+        "hashed_password": "hashed_password_123",
+        "created_at": datetime(2025,1,1,12,0,0,tzinfo=timezone.utc),
+        "profile_version": 0,
+        **fields
+    }
+
+@pytest.fixture
+def memory_repository():
+    previous = get_user_repository()
+    repository = MemoryUserRepository()
+    set_user_repository(repository)
+    yield repository
+    set_user_repository(previous)
+
+def test_memory_repository_indexes():
+    repository = MemoryUserRepository()
+    user = new_user("test@example.com")
+
+    asyncio.run(repository.create(user))
+
+    by_email = asyncio.run(repository.find_by_email("test@example.com"))
+    by_id = asyncio.run(repository.find_by_id(str(user["_id"])))
+    assert by_email["hashed_password"] == "hashed_password_123"
+    assert "hashed_password" not in by_id
+    assert by_id["email"] == "test@example.com"
+    assert asyncio.run(repository.find_by_id("not-an-id")) is None
+
+    with pytest.raises(DuplicateUserError):
+        asyncio.run(repository.create(new_user("test@example.com")))
+
+def test_memory_repository_update_moves_email():
+    repository = MemoryUserRepository()
+    user, other = new_user("test@example.com"), new_user("other@example.com")
+    asyncio.run(repository.create(user))
+    asyncio.run(repository.create(other))
+
+    updated = asyncio.run(repository.update_profile(user["_id"], {"email": "new@example.com"}))
+
+    assert updated["profile_version"] == 1
+    assert asyncio.run(repository.find_by_email("test@example.com")) is None
+    assert asyncio.run(repository.find_by_email("new@example.com"))["_id"] == user["_id"]
+    with pytest.raises(DuplicateUserError):
+        asyncio.run(repository.update_profile(user["_id"], {"email": "other@example.com"}))
+
+    assert asyncio.run(repository.delete(other["_id"]))
+    assert not asyncio.run(repository.delete(other["_id"]))
+    assert asyncio.run(repository.find_many_by_emails(["new@example.com", "other@example.com"])) == [
+            asyncio.run(repository.find_by_id(user["_id"]))
+            ]
+
+def test_memory_repository_concurrent_registrations():
+    repository = MemoryUserRepository()
+
+    def register(index: int) -> bool:
+        try:
+            asyncio.run(repository.create(new_user(f"user{index % 50}@example.com")))
+            return True
+        except DuplicateUserError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        created = list(executor.map(register, range(400)))
+
+    assert sum(created) == 50
+    assert len(repository) == 50
+
+def test_incomplete_repository_fails_when_created():
+    class ReadOnlyRepository(UserRepository):
+        async def find_by_id(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyRepository()
+
+def test_routes_on_memory_repository(client, token_settings, memory_repository, mocker):
+    mocker.patch("app.routes.auth.hash_password", return_value="hashed_password_123")
+    mocker.patch("app.routes.auth.verify_password", return_value=True)
+
+    registered = client.post("/auth/register", json={
+        "email":"test@example.com",
+        "username":"test_user",
+        "password":"12345",
+        "confirm_password":"12345"
+        })
+    token = client.post("/auth/login", json={"email":"test@example.com", "password":"12345"}).json()["access_token"]
+    headers = {"authorization":f"bearer {token}"}
+    updated = client.put("/users/me", json={"username":"updated_username"}, headers=headers)
+    profile = client.get("/users/me", headers=headers)
+
+    assert registered.status_code == 201
+    assert updated.status_code == 200
+    assert profile.json() == {**registered.json(), "username": "updated_username"}
+    assert client.delete("/users/me", headers=headers).status_code == 204
+    assert len(memory_repository) == 0
+
+def test_memory_repository_keyset_pages():
+    repository = MemoryUserRepository()
+    users = [new_user(f"user{index}@example.com") for index in range(5)]
+    for user in reversed(users):
+        asyncio.run(repository.create(user))
+
+    first = asyncio.run(repository.list_users(None, 2))
+    second = asyncio.run(repository.list_users(first[-1]["_id"], 2))
+
+    assert [user["_id"] for user in first + second] == [user["_id"] for user in users[:4]]
+    assert set(first[0]) == {"_id", "username", "email", "created_at"}
+
+async def collect(iterator) -> list:
+    return [item async for item in iterator]
+
+def test_admin_export_streams_ndjson(client, token_settings, memory_repository, use_settings):
+    settings = use_settings(**{**token_settings.model_dump(), "user_export_batch_size": 2})
+    admin = new_user("admin@example.com", role="admin")
+    users = [admin] + [new_user(f"user{index}@example.com") for index in range(4)]
+    for user in users:
+        asyncio.run(memory_repository.create(user))
+    token = create_access_token({"sub": str(admin["_id"]), "email": admin["email"]})
+
+    response = client.get("/users/export", headers={"authorization":f"bearer {token}"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == sorted(str(user["_id"]) for user in users)
+    assert len(asyncio.run(collect(memory_repository.iter_users(settings.user_export_batch_size)))) == 5
@@ -0,0 +1,84 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from app.utils.revocation import RevocationList, revocation_list
+from app.utils.security import create_access_token, verify_token
+
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+@pytest.fixture(autouse=True)
+def clear_revocations():
+    revocation_list.clear()
+    yield
+    revocation_list.clear()
+
+def test_logout_revokes_token(client, mocker, token_settings):
+    mock_collection = mocker.AsyncMock()
+    mocker.patch("app.utils.revocation.get_collection", return_value=mock_collection)
+
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+    jti = verify_token(token)["jti"]
+
+    response = client.post("/auth/logout", headers={"authorization":f"bearer {token}"})
+
+    assert response.status_code == 204
+    inserted = mock_collection.insert_one.call_args.args[0]
+    assert inserted["jti"] == jti
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(token)
+
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == "Token revoked"
+
+    response = client.post("/auth/logout", headers={"authorization":f"bearer {token}"})
+    assert response.status_code == 401
+
+def test_other_tokens_stay_valid(client, mocker, token_settings):
+    mocker.patch("app.utils.revocation.get_collection", return_value=mocker.AsyncMock())
+
+    revoked_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+    other_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    client.post("/auth/logout", headers={"authorization":f"bearer {revoked_token}"})
+
+    assert verify_token(other_token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_refresh_loads_revocations_incrementally(mocker):
+    now = datetime.now(timezone.utc)
+    mock_collection = mocker.MagicMock()
+    mock_collection.find.side_effect = [
+            AsyncCursor([
+                {"jti": "revoked", "expires_at": now + timedelta(minutes=10), "revoked_at": now},
+                {"jti": "expired", "expires_at": now - timedelta(minutes=1), "revoked_at": now - timedelta(minutes=2)}
+                ]),
+            AsyncCursor([])
+            ]
+    mocker.patch("app.utils.revocation.get_collection", return_value=mock_collection)
+
+    revocations = RevocationList(refresh_interval=5)
+    asyncio.run(revocations.refresh())
+
+    assert revocations.is_revoked("revoked")
+    assert not revocations.is_revoked("expired")
+    assert not revocations.is_revoked(None)
+    assert mock_collection.find.call_args_list[0].args[0] == {}
+
+    asyncio.run(revocations.refresh())
+
+    query = mock_collection.find.call_args_list[1].args[0]
+    assert query["revoked_at"]["$gte"] < now
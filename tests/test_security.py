@@ -0,0 +1,182 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import jwt
+from datetime import timedelta
+from fastapi import HTTPException
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from app.utils.security import create_access_token, verify_token, get_token_verifier, get_key_ring, hash_password, needs_rehash
+from app.utils.calibrate import calibrate
+
+def private_key_pem(private_key) -> str:
+    return private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+            ).decode()
+
+@pytest.fixture
+def es256_settings(use_settings):
+    return use_settings(algorithm="ES256", private_key=private_key_pem(ec.generate_private_key(ec.SECP256R1())))
+
+def test_verify_token_caches_payload(token_settings):
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    first = verify_token(token)
+    second = verify_token(f"Bearer {token}")
+
+    assert first == second
+    assert first["sub"] == "507f1f77bcf86cd799439011"
+
+    stats = get_token_verifier().cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+def test_cached_payload_is_not_shared(token_settings):
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    verify_token(token)["sub"] = "tampered"
+
+    assert verify_token(token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_expired_token_is_rejected_and_not_cached(token_settings):
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"}, timedelta(seconds=-5))
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(token)
+
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == "Token expired"
+    assert get_token_verifier().cache.stats()["size"] == 0
+
+def test_invalid_token(token_settings):
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token("not.a.token")
+
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == "Invalid token"
+
+# asymmetric signing and JWKS
+def test_es256_token_round_trip(es256_settings):
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    assert jwt.get_unverified_header(token)["alg"] == "ES256"
+    assert verify_token(token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_eddsa_token_round_trip(use_settings):
+    use_settings(algorithm="EdDSA", private_key=private_key_pem(ed25519.Ed25519PrivateKey.generate()))
+
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    assert verify_token(token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_jwks_publishes_public_key(client, es256_settings):
+    token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    response = client.get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert "max-age=" in response.headers["cache-control"]
+    keys = response.json()["keys"]
+    assert len(keys) == 1
+    assert keys[0]["alg"] == "ES256"
+    assert "d" not in keys[0]
+
+    public_key = jwt.PyJWK(keys[0]).key
+    payload = jwt.decode(token, public_key, algorithms=["ES256"])
+    assert payload["sub"] == "507f1f77bcf86cd799439011"
+
+def test_jwks_not_modified(client, es256_settings):
+    etag = client.get("/.well-known/jwks.json").headers["etag"]
+
+    response = client.get("/.well-known/jwks.json", headers={"if-none-match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+def test_jwks_is_empty_for_hmac(client, token_settings):
+
+    response = client.get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+
+# key ring rotation
+def test_retired_key_still_verifies(use_settings):
+    use_settings(secret_key="test_secret_key", key_id="2025-01")
+    old_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    use_settings(secret_key="rotated_secret_key", key_id="2025-02", retired_keys="2025-01=test_secret_key")
+    new_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    assert jwt.get_unverified_header(old_token)["kid"] == "2025-01"
+    assert jwt.get_unverified_header(new_token)["kid"] == "2025-02"
+    assert verify_token(old_token)["sub"] == "507f1f77bcf86cd799439011"
+    assert verify_token(new_token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_rotation_to_another_algorithm(use_settings):
+    use_settings(secret_key="test_secret_key", key_id="2025-01")
+    old_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+    # issued before kid headers existed
+    unversioned_token = jwt.encode({"sub":"507f1f77bcf86cd799439011"}, "test_secret_key", "HS256")
+
+    use_settings(
+            algorithm="ES256",
+            private_key=private_key_pem(ec.generate_private_key(ec.SECP256R1())),
+            retired_keys="2025-01=HS256:test_secret_key"
+            )
+    new_token = create_access_token({"sub":"507f1f77bcf86cd799439011"})
+
+    assert jwt.get_unverified_header(new_token)["alg"] == "ES256"
+    assert get_key_ring().keys["2025-01"].algorithm == "HS256"
+    assert verify_token(old_token)["sub"] == "507f1f77bcf86cd799439011"
+    assert verify_token(unversioned_token)["sub"] == "507f1f77bcf86cd799439011"
+    assert verify_token(new_token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_unknown_kid_is_rejected(token_settings):
+    token = jwt.encode({"sub":"507f1f77bcf86cd799439011"}, "test_secret_key", "HS256", headers={"kid":"unknown"})
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(token)
+
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == "Invalid token"
+
+def test_token_without_kid_uses_active_key(token_settings):
+    token = jwt.encode({"sub":"507f1f77bcf86cd799439011"}, "test_secret_key", "HS256")
+
+    assert verify_token(token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_jwks_lists_retired_keys(client, use_settings, tmp_path, es256_settings):
+    retired_key = ec.generate_private_key(ec.SECP256R1())
+    public_key_path = tmp_path / "retired.pem"
+    public_key_path.write_bytes(retired_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+            ))
+    use_settings(algorithm="ES256", private_key=es256_settings.private_key, retired_keys=f"retired={public_key_path}")
+
+    old_token = jwt.encode({"sub":"507f1f77bcf86cd799439011"}, retired_key, "ES256", headers={"kid":"retired"})
+
+    keys = client.get("/.well-known/jwks.json").json()["keys"]
+
+    assert sorted(key["kid"] for key in keys) == sorted(["retired", get_key_ring().active.kid])
+    assert verify_token(old_token)["sub"] == "507f1f77bcf86cd799439011"
+
+def test_needs_rehash_compares_cost(use_settings):
+    use_settings(bcrypt_rounds=5)
+
+    assert needs_rehash(hash_password("password", rounds=4))
+    assert not needs_rehash(hash_password("password"))
+    assert not needs_rehash("not a bcrypt hash")
+
+def test_calibrate_picks_highest_cost_within_target():
+    # each cost doubles the time, 4 -> 10ms ... 8 -> 160ms, 9 -> 320ms
+    measure = lambda rounds: 10 * 2 ** (rounds - 4)
+
+    assert calibrate(250, measure) == (8, 160)
+    assert calibrate(1, measure) == (4, 10)
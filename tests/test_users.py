@@ -5,14 +5,22 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import pytest
 from datetime import datetime, timezone
+from app.utils.dependencies import user_cache
+from app.utils.revocation import revocation_list
+from app.database import USER_LIST_PROJECTION, USER_RESPONSE_PROJECTION
+from app.models import UserResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from app.utils.security import create_access_token, user_claims, verify_token
 
 # tests for GET /users/me
 def test_successful_response(mocker, client, mock_user, mock_verify_token, mock_token):
     
-    mock_get_collection_dependencies = mocker.MagicMock()
+    mock_get_collection_dependencies = mocker.AsyncMock()
     mock_get_collection_dependencies.find_one.return_value = mock_user
 
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection_dependencies)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
 
@@ -33,10 +41,10 @@ def test_call_without_token(client):
 
 def test_if_user_not_found(client, mock_token, mock_verify_token, mocker):
 
-    mock_get_collection_dependencies = mocker.MagicMock()
+    mock_get_collection_dependencies = mocker.AsyncMock()
     mock_get_collection_dependencies.find_one.return_value = None
 
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection_dependencies)
 
     response = client.get("/users/me", headers={"authorization":f"bearer {mock_token}"})
 
@@ -47,18 +55,15 @@ def test_if_user_not_found(client, mock_token, mock_verify_token, mocker):
 # tests for PUT /users/me
 def test_if_update_username_correctly(client, mocker, mock_verify_token, mock_token, mock_user):
     
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
     
     mock_update_data = {
             "username":"updated_username"
             }
 
-    mock_get_collection = mocker.MagicMock()
-    mock_get_collection.update_one.return_value = None
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
  
@@ -68,10 +73,11 @@ def test_if_update_username_correctly(client, mocker, mock_verify_token, mock_to
         "username":mock_update_data["username"],
         "email": "test@example.com",
         "hashed_password": "hashed_password_123",
-        "created_at":fixed_date
+        "created_at":fixed_date,
+        "profile_version": 1
             }
     
-    mock_get_collection.find_one.return_value = mock_user_updated
+    mock_get_collection.find_one_and_update.return_value = mock_user_updated
 
     response = client.put("/users/me", json=mock_update_data, headers={"authorization":f"bearer {mock_token}"})
 
@@ -79,22 +85,25 @@ def test_if_update_username_correctly(client, mocker, mock_verify_token, mock_to
     data = response.json()
     assert data["username"] == mock_update_data["username"]
     assert data["email"] == "test@example.com"
-    mock_get_collection.update_one.assert_called_once_with({"_id":"user123"},{"$set": mock_update_data})
+    mock_get_collection.find_one_and_update.assert_called_once_with(
+            {"_id":"user123"},
+            {"$set": mock_update_data, "$inc": {"profile_version": 1}},
+            projection=USER_RESPONSE_PROJECTION,
+            return_document=ReturnDocument.AFTER
+            )
+    mock_get_collection.find_one.assert_called_once()
 
 def test_if_update_email_correctly(client, mocker, mock_user, mock_verify_token, mock_token):
 
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
     
     mock_update_data = {
             "email":"test_example_updated@gmail.com"
             }
 
-    mock_get_collection = mocker.MagicMock()
-    mock_get_collection.update_one.return_value = None
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
  
@@ -104,10 +113,11 @@ def test_if_update_email_correctly(client, mocker, mock_user, mock_verify_token,
         "username":"test_user",
         "email": mock_update_data["email"],
         "hashed_password": "hashed_password_123",
-        "created_at":fixed_date
+        "created_at":fixed_date,
+        "profile_version": 1
             }
     
-    mock_get_collection.find_one.side_effect = [None, mock_user_updated]
+    mock_get_collection.find_one_and_update.return_value = mock_user_updated
 
     response = client.put("/users/me", json=mock_update_data, headers={"authorization":f"bearer {mock_token}"})
 
@@ -115,23 +125,26 @@ def test_if_update_email_correctly(client, mocker, mock_user, mock_verify_token,
     data = response.json()
     assert data["username"] == "test_user"
     assert data["email"] == mock_update_data["email"]
-    mock_get_collection.update_one.assert_called_once_with({"_id":"user123"},{"$set": mock_update_data})
+    mock_get_collection.find_one_and_update.assert_called_once_with(
+            {"_id":"user123"},
+            {"$set": mock_update_data, "$inc": {"profile_version": 1}},
+            projection=USER_RESPONSE_PROJECTION,
+            return_document=ReturnDocument.AFTER
+            )
+    mock_get_collection.find_one.assert_called_once()
 
 def test_if_update_email_and_username_correctly(client, mocker, mock_user, mock_verify_token, mock_token):
 
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
     
     mock_update_data = {
             "username":"updated_username",
             "email":"test_example_updated@gmail.com"
             }
 
-    mock_get_collection = mocker.MagicMock()
-    mock_get_collection.update_one.return_value = None
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
  
@@ -141,10 +154,11 @@ def test_if_update_email_and_username_correctly(client, mocker, mock_user, mock_
         "username":mock_update_data["username"],
         "email": mock_update_data["email"],
         "hashed_password": "hashed_password_123",
-        "created_at":fixed_date
+        "created_at":fixed_date,
+        "profile_version": 1
             }
     
-    mock_get_collection.find_one.side_effect = [None, mock_user_updated]
+    mock_get_collection.find_one_and_update.return_value = mock_user_updated
 
     response = client.put("/users/me", json=mock_update_data, headers={"authorization":f"bearer {mock_token}"})
 
@@ -152,81 +166,71 @@ def test_if_update_email_and_username_correctly(client, mocker, mock_user, mock_
     data = response.json()
     assert data["username"] == mock_update_data["username"]
     assert data["email"] == mock_update_data["email"]
-    mock_get_collection.update_one.assert_called_once_with({"_id":"user123"},{"$set": mock_update_data})
+    mock_get_collection.find_one_and_update.assert_called_once_with(
+            {"_id":"user123"},
+            {"$set": mock_update_data, "$inc": {"profile_version": 1}},
+            projection=USER_RESPONSE_PROJECTION,
+            return_document=ReturnDocument.AFTER
+            )
+    mock_get_collection.find_one.assert_called_once()
 
 def test_if_email_already_exist(client, mocker, mock_user, mock_verify_token, mock_token):
 
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
     
     mock_update_data = {
             "email":"existing@gmail.com"
             }
 
-    mock_get_collection = mocker.MagicMock()
-    mock_get_collection.update_one.return_value = None
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
- 
-    fixed_date = datetime(2025,1,1,12,0,0,tzinfo=timezone.utc)
-    mock_user_updated = {
-        "_id": "user123",
-        "username":"test_user",
-        "email": mock_update_data["email"],
-        "hashed_password": "hashed_password_123",
-        "created_at":fixed_date
-            }
-    
-    mock_get_collection.find_one.return_value = mock_user_updated
+
+    mock_get_collection.find_one_and_update.side_effect = DuplicateKeyError("E11000 duplicate key error")
 
     response = client.put("/users/me", json=mock_update_data, headers={"authorization":f"bearer {mock_token}"})
 
     assert response.status_code == 409
     data = response.json()
     assert data["detail"] == "Incorrect Credentials"
-    mock_get_collection.update_one.assert_not_called()
+    mock_get_collection.find_one_and_update.assert_called_once()
 
 def test_that_fields_are_not_empty(client, mocker, mock_user, mock_verify_token, mock_token):
 
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
     
     mock_update_data = {
             "username":None,
             "email":None
             }
 
-    mock_get_collection = mocker.MagicMock()
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
 
     response = client.put("/users/me", json=mock_update_data, headers={"authorization":f"bearer {mock_token}"})
 
     assert response.status_code == 422
-    mock_get_collection.update_one.assert_not_called()
-    mock_get_collection.find_one.assert_not_called()
+    mock_get_collection.find_one_and_update.assert_not_called()
+    mock_get_collection.find_one.assert_called_once()
 
 # tests for DELETE /users/me
 def test_if_delete_user_correctly(client, mock_user, mock_token, mocker, mock_verify_token):
     
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
 
     mock_delete_result = mocker.MagicMock()
     mock_delete_result.deleted_count = 1
 
-    mock_get_collection = mocker.MagicMock()
     mock_get_collection.delete_one.return_value = mock_delete_result
 
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
 
@@ -237,18 +241,16 @@ def test_if_delete_user_correctly(client, mock_user, mock_token, mocker, mock_ve
 
 def test_if_user_not_found_on_delete(client, mock_token, mocker, mock_verify_token, mock_user):
     
-    mock_get_collection_dependencies = mocker.MagicMock()
-    mock_get_collection_dependencies.find_one.return_value = mock_user
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = mock_user
 
     mock_delete_result = mocker.MagicMock()
     mock_delete_result.deleted_count = 0
 
-    mock_get_collection = mocker.MagicMock()
     mock_get_collection.delete_one.return_value = mock_delete_result
 
 
-    mocker.patch("app.routes.users.get_collection", return_value=mock_get_collection)
-    mocker.patch("app.utils.dependencies.get_collection", return_value=mock_get_collection_dependencies)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
     mock_dependency = mocker.patch("app.routes.users.get_current_user")
     mock_dependency.return_value = mock_user
 
@@ -256,3 +258,290 @@ def test_if_user_not_found_on_delete(client, mock_token, mocker, mock_verify_tok
 
     assert response.status_code == 404
     mock_get_collection.delete_one.assert_called_once_with({"_id":"user123"})
+
+# tests for the user cache
+def test_user_is_served_from_cache(client, mocker, mock_user, mock_verify_token, mock_token):
+
+    mock_get_collection_dependencies = mocker.AsyncMock()
+    mock_get_collection_dependencies.find_one.return_value = mock_user
+
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection_dependencies)
+
+    first = client.get("/users/me", headers={"authorization":f"bearer {mock_token}"})
+    second = client.get("/users/me", headers={"authorization":f"bearer {mock_token}"})
+
+    assert first.status_code == 200
+    assert second.json() == first.json()
+    mock_get_collection_dependencies.find_one.assert_called_once()
+
+def test_delete_invalidates_cached_user(client, mocker, mock_user, mock_verify_token, mock_token, mock_payload):
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = {**mock_user, "_id": mock_payload["sub"]}
+
+    mock_delete_result = mocker.MagicMock()
+    mock_delete_result.deleted_count = 1
+
+    mock_get_collection.delete_one.return_value = mock_delete_result
+
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    client.get("/users/me", headers={"authorization":f"bearer {mock_token}"})
+    assert user_cache.get(mock_payload["sub"]) is not None
+
+    response = client.delete("/users/me", headers={"authorization":f"bearer {mock_token}"})
+
+    assert response.status_code == 204
+    assert user_cache.get(mock_payload["sub"]) is None
+
+# tests for the profile claims mode
+@pytest.fixture
+def revoked_tokens(mocker):
+    revocation_list.clear()
+    mock_collection = mocker.AsyncMock()
+    mocker.patch("app.utils.revocation.get_collection", return_value=mock_collection)
+    yield mock_collection
+    revocation_list.clear()
+
+@pytest.fixture
+def claims_user(use_settings, revoked_tokens):
+    use_settings(secret_key="test_secret_key", profile_claims=True)
+    return {
+        "_id": ObjectId("507f1f77bcf86cd799439011"),
+        "username": "test_user",
+        "email": "test@example.com",
+        "created_at": datetime(2025,1,1,12,0,0,tzinfo=timezone.utc),
+        "profile_version": 2
+    }
+
+def test_profile_served_from_claims(client, mocker, claims_user):
+    mock_get_collection = mocker.patch("app.repository.get_collection")
+    token = create_access_token(user_claims(claims_user))
+
+    response = client.get("/users/me", headers={"authorization":f"bearer {token}"})
+
+    assert response.status_code == 200
+    assert response.json() == {
+            "id": "507f1f77bcf86cd799439011",
+            "username": "test_user",
+            "email": "test@example.com",
+            "created_at": "2025-01-01T12:00:00Z"
+            }
+    mock_get_collection.assert_not_called()
+
+def test_update_issues_token_and_outdates_old_one(client, mocker, claims_user):
+    old_token = create_access_token(user_claims(claims_user))
+    updated_user = {**claims_user, "username": "updated_username", "profile_version": 3}
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = claims_user
+    mock_get_collection.find_one_and_update.return_value = updated_user
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.put("/users/me", json={"username":"updated_username"}, headers={"authorization":f"bearer {old_token}"})
+
+    assert response.status_code == 200
+    new_token = response.headers["X-Access-Token"]
+    assert verify_token(new_token)["username"] == "updated_username"
+    assert verify_token(new_token)["pv"] == 3
+
+    # the old token is now answered from the (cached) database document
+    response = client.get("/users/me", headers={"authorization":f"bearer {old_token}"})
+    assert response.json()["username"] == "updated_username"
+
+    mock_get_collection.find_one.reset_mock()
+    response = client.get("/users/me", headers={"authorization":f"bearer {new_token}"})
+    assert response.json()["username"] == "updated_username"
+    mock_get_collection.find_one.assert_not_called()
+
+def test_update_outdates_old_tokens_on_every_worker(client, mocker, claims_user, revoked_tokens):
+    old_token = create_access_token(user_claims(claims_user))
+    updated_user = {**claims_user, "username": "updated_username", "profile_version": 3}
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = updated_user
+    mock_get_collection.find_one_and_update.return_value = updated_user
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    client.put("/users/me", json={"username":"updated_username"}, headers={"authorization":f"bearer {old_token}"})
+
+    # the marker goes through the revoked tokens other workers refresh from
+    inserted = revoked_tokens.insert_one.call_args.args[0]
+    assert inserted["jti"] == "profile:507f1f77bcf86cd799439011:2"
+
+    # a worker without the cached document, or which evicted it, reads it again
+    user_cache.clear()
+    mock_get_collection.find_one.reset_mock()
+    response = client.get("/users/me", headers={"authorization":f"bearer {old_token}"})
+
+    assert response.json()["username"] == "updated_username"
+    mock_get_collection.find_one.assert_awaited_once()
+
+def test_delete_outdates_all_tokens(client, mocker, claims_user, revoked_tokens):
+    token = create_access_token(user_claims(claims_user))
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = claims_user
+    mock_get_collection.delete_one.return_value.deleted_count = 1
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    assert client.delete("/users/me", headers={"authorization":f"bearer {token}"}).status_code == 204
+    assert revoked_tokens.insert_one.call_args.args[0]["jti"] == "profile:507f1f77bcf86cd799439011"
+
+    mock_get_collection.find_one.return_value = None
+    response = client.get("/users/me", headers={"authorization":f"bearer {token}"})
+
+    assert response.status_code == 404
+
+def test_profile_claims_ignored_when_disabled(client, mocker, claims_user, use_settings):
+    token = create_access_token(user_claims(claims_user))
+    use_settings(secret_key="test_secret_key")
+
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = None
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.get("/users/me", headers={"authorization":f"bearer {token}"})
+
+    assert response.status_code == 404
+    mock_get_collection.find_one.assert_awaited_once()
+
+# tests for the conditional GET /users/me
+def test_profile_etag_and_not_modified(client, mocker, mock_user, mock_verify_token, mock_token):
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = {**mock_user, "profile_version": 4}
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.get("/users/me", headers={"authorization":f"bearer {mock_token}"})
+    etag = response.headers["ETag"]
+
+    assert response.status_code == 200
+    assert etag == '"user123-4"'
+
+    response = client.get("/users/me", headers={"authorization":f"bearer {mock_token}", "if-none-match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    mock_get_collection.find_one.assert_awaited_once()
+
+def test_profile_etag_changes_with_update(client, mocker, mock_user, mock_verify_token, mock_token):
+    user = {**mock_user, "_id": mock_verify_token.return_value["sub"], "profile_version": 4}
+    mock_get_collection = mocker.AsyncMock()
+    mock_get_collection.find_one.return_value = user
+    mock_get_collection.find_one_and_update.return_value = {**user, "username": "updated_username", "profile_version": 5}
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    old_etag = client.get("/users/me", headers={"authorization":f"bearer {mock_token}"}).headers["ETag"]
+    update = client.put("/users/me", json={"username":"updated_username"}, headers={"authorization":f"bearer {mock_token}"})
+    response = client.get("/users/me", headers={"authorization":f"bearer {mock_token}", "if-none-match": old_etag})
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "updated_username"
+    assert response.headers["ETag"] == update.headers["ETag"] == '"507f1f77bcf86cd799439011-5"'
+
+# tests for POST /users/lookup
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+@pytest.fixture
+def service_payload(mock_verify_token):
+    mock_verify_token.return_value = {"sub": "billing", "client_id": "billing", "scope": "users:lookup"}
+    return mock_verify_token.return_value
+
+def test_lookup_by_ids_in_request_order(client, mocker, service_payload, mock_token):
+    first = {"_id": ObjectId("507f1f77bcf86cd799439011"), "username": "first", "email": "first@example.com", "created_at": datetime(2025,1,1,tzinfo=timezone.utc)}
+    second = {"_id": ObjectId("507f1f77bcf86cd799439012"), "username": "second", "email": "second@example.com", "created_at": datetime(2025,1,2,tzinfo=timezone.utc)}
+    mock_get_collection = mocker.MagicMock()
+    mock_get_collection.find.return_value = AsyncCursor([first, second])
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    ids = ["507f1f77bcf86cd799439012", "not-an-id", "507f1f77bcf86cd799439013", "507f1f77bcf86cd799439011"]
+    response = client.post("/users/lookup", json={"ids": ids}, headers={"authorization":f"bearer {mock_token}"})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["key"] for result in results] == ids
+    assert results[0]["user"]["username"] == "second"
+    assert results[1]["user"] is None
+    assert results[2]["user"] is None
+    assert results[3]["user"]["id"] == "507f1f77bcf86cd799439011"
+
+    mock_get_collection.find.assert_called_once()
+    query, projection = mock_get_collection.find.call_args.args
+    assert sorted(query["_id"]["$in"]) == [first["_id"], second["_id"], ObjectId("507f1f77bcf86cd799439013")]
+    assert projection == USER_RESPONSE_PROJECTION
+
+def test_lookup_by_emails(client, mocker, service_payload, mock_token, mock_user):
+    mock_get_collection = mocker.MagicMock()
+    mock_get_collection.find.return_value = AsyncCursor([mock_user])
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+
+    response = client.post("/users/lookup", json={"emails": ["Test@example.com", "missing@example.com"]}, headers={"authorization":f"bearer {mock_token}"})
+
+    results = response.json()["results"]
+    assert results[0]["user"]["email"] == "test@example.com"
+    assert results[1] == {"key": "missing@example.com", "user": None}
+
+def test_lookup_limits(client, mocker, service_payload, mock_token, use_settings):
+    use_settings(user_lookup_max=2)
+    mock_get_collection = mocker.patch("app.repository.get_collection")
+    headers = {"authorization":f"bearer {mock_token}"}
+
+    too_many = client.post("/users/lookup", json={"ids": ["a", "b", "c"]}, headers=headers)
+    # rejected on its size, before the (invalid) emails are validated
+    too_many_emails = client.post("/users/lookup", json={"emails": ["a", "b", "c"]}, headers=headers)
+    both = client.post("/users/lookup", json={"ids": ["a"], "emails": ["a@example.com"]}, headers=headers)
+
+    assert too_many.status_code == 422
+    assert [error["loc"] for error in too_many_emails.json()["detail"]] == [["body", "emails"]]
+    assert both.status_code == 422
+    mock_get_collection.assert_not_called()
+
+def test_lookup_refuses_user_tokens(client, mocker, mock_verify_token, mock_token):
+    mock_get_collection = mocker.patch("app.repository.get_collection")
+
+    response = client.post("/users/lookup", json={"emails": ["b@example.com"]}, headers={"authorization":f"bearer {mock_token}"})
+
+    assert response.status_code == 403
+    mock_get_collection.assert_not_called()
+
+# tests for GET /users and GET /users/export
+def test_listing_requires_admin(client, mocker, mock_verify_token, mock_token, mock_user):
+    mock_get_collection = mocker.MagicMock()
+    mock_get_collection.find_one = mocker.AsyncMock(return_value=mock_user)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+    headers = {"authorization":f"bearer {mock_token}"}
+
+    assert client.get("/users", headers=headers).status_code == 403
+    assert client.get("/users/export", headers=headers).status_code == 403
+    mock_get_collection.find.assert_not_called()
+
+def test_listing_keyset_page(client, mocker, mock_verify_token, mock_token, mock_user, use_settings):
+    use_settings(secret_key="test_secret_key", algorithm="HS256", user_page_max=2)
+    users = [
+        {"_id": ObjectId(f"507f1f77bcf86cd79943901{index}"), "username": f"user{index}", "email": f"user{index}@example.com", "created_at": datetime(2025,1,1,tzinfo=timezone.utc)}
+        for index in range(3)
+        ]
+    mock_get_collection = mocker.MagicMock()
+    mock_get_collection.find_one = mocker.AsyncMock(return_value={**mock_user, "role": "admin"})
+    mock_get_collection.find.return_value.sort.return_value.limit.return_value = AsyncCursor(users)
+    mocker.patch("app.repository.get_collection", return_value=mock_get_collection)
+    headers = {"authorization":f"bearer {mock_token}"}
+
+    response = client.get("/users", params={"after": "507f1f77bcf86cd79943900f", "limit": 2}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["next"] == "507f1f77bcf86cd799439011"
+    assert [user["username"] for user in response.json()["users"]] == ["user0", "user1"]
+    assert set(response.json()["users"][0]) == set(UserResponse.model_fields)
+    mock_get_collection.find.assert_called_once_with({"_id": {"$gt": ObjectId("507f1f77bcf86cd79943900f")}}, USER_LIST_PROJECTION)
+    mock_get_collection.find.return_value.sort.assert_called_once_with("_id", 1)
+    mock_get_collection.find.return_value.sort.return_value.limit.assert_called_once_with(3)
+
+    assert client.get("/users", params={"limit": 3}, headers=headers).status_code == 422
+    assert client.get("/users", params={"after": "not-an-id"}, headers=headers).status_code == 422